@@ -17,7 +17,9 @@
 import argparse
 import sys
 
+from freecad_scripts import artifacts
 from freecad_scripts import pressure_vessel
+from freecad_scripts import resultstore
 from freecad_scripts import libs
 
 
@@ -25,7 +27,7 @@ def run():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('command', nargs='?', help="""
-    pressure-vessel
+    pressure-vessel, results, artifacts
     """)
     args = parser.parse_args(sys.argv[1:2])
 
@@ -36,6 +38,10 @@ def run():
 
     if args.command == 'pressure-vessel':
         pressure_vessel.run(args=sys.argv[2:])
+    elif args.command == 'results':
+        resultstore.run(args=sys.argv[2:])
+    elif args.command == 'artifacts':
+        artifacts.run(args=sys.argv[2:])
     else:
         parser.print_help()
 
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import BinaryIO, Dict, List, Optional
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+from freecad_scripts.frdreader import read_frd_results
+
+
+# the sections of the files start at these lines, so the node and element
+# blocks are stored apart from the headers with time stamps, the material,
+# the loads and the results
+SECTION_MARKERS = {
+    '.inp': [b'\n*MATERIAL'],
+    '.frd': [b'\n    2C', b'\n    1PSTEP'],
+}
+
+
+def split_sections(name: str, data: bytes) -> List[bytes]:
+    """
+    Splits the content of a solver file at its section markers, so runs
+    sharing a geometry share the mesh section.
+    """
+    markers = SECTION_MARKERS.get(os.path.splitext(name)[1].lower(), [])
+    sections = []
+    start = 0
+    for marker in markers:
+        pos = data.find(marker, start)
+        if pos < 0:
+            continue
+        sections.append(data[start:pos + 1])
+        start = pos + 1
+    sections.append(data[start:])
+    return sections
+
+
+class ArtifactStore(object):
+    """
+    A directory of gzip compressed solver files (INP, FRD, DAT) indexed by
+    design key. Files are split into a mesh section and the rest, and the
+    sections are stored as content addressed blobs, so designs sharing a
+    geometry store their mesh only once. An SQLite index in the directory
+    maps each design key and file name to its list of blobs.
+    """
+
+    def __init__(self, directory: str, level: int = 6):
+        self.directory = directory
+        self.level = level
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(directory, 'index.db'),
+                                    timeout=600.0)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY, size INTEGER, stored_size INTEGER)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS artifacts (
+            design_key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            blobs TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            PRIMARY KEY (design_key, name))""")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get_blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'blobs', digest[:2], digest + '.gz')
+
+    def add_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        if self.conn.execute('SELECT 1 FROM blobs WHERE hash = ?',
+                             (digest,)).fetchone() is not None:
+            return digest
+
+        path = self.get_blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = '{}.{}.tmp'.format(path, os.getpid())
+            with gzip.open(temp, 'wb', compresslevel=self.level) as file:
+                file.write(data)
+            os.replace(temp, path)
+        self.conn.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)',
+                          (digest, len(data), os.path.getsize(path)))
+        return digest
+
+    def add(self, design_key: str, files: Dict[str, str]):
+        """
+        Stores the given files of a run under the design key, where files
+        maps the artifact names (e.g. 'inp') to the paths of the files.
+        Missing files are skipped, earlier artifacts of the same design and
+        name are replaced.
+        """
+        for name, path in files.items():
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as file:
+                data = file.read()
+            blobs = [self.add_blob(section)
+                     for section in split_sections(path, data)]
+            self.conn.execute('INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)',
+                              (design_key, name, json.dumps(blobs), len(data), time.time()))
+        self.conn.commit()
+
+    def get_names(self, design_key: str) -> List[str]:
+        return [row[0] for row in self.conn.execute(
+            'SELECT name FROM artifacts WHERE design_key = ? ORDER BY name',
+            (design_key,))]
+
+    def get_keys(self) -> List[str]:
+        return [row[0] for row in self.conn.execute(
+            'SELECT DISTINCT design_key FROM artifacts ORDER BY design_key')]
+
+    def open(self, design_key: str, name: str) -> BinaryIO:
+        """
+        Returns a binary file object that decompresses the sections of the
+        given artifact while it is read, e.g. for frdreader.read_frd_results.
+        """
+        row = self.conn.execute(
+            'SELECT blobs FROM artifacts WHERE design_key = ? AND name = ?',
+            (design_key, name)).fetchone()
+        if row is None:
+            raise KeyError("No {} artifact for design {}".format(name, design_key))
+        paths = [self.get_blob_path(digest) for digest in json.loads(row[0])]
+        return io.BufferedReader(_SectionReader(paths))
+
+    def extract(self, design_key: str, name: str, output: str):
+        with self.open(design_key, name) as source, open(output, 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Returns the total size of the stored artifacts and the size of their
+        compressed and deduplicated blobs in bytes.
+        """
+        size = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+        stored = self.conn.execute(
+            'SELECT COALESCE(SUM(stored_size), 0) FROM blobs').fetchone()[0]
+        return {'artifact_size': size, 'stored_size': stored}
+
+
+def run(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('directory', type=str, metavar='DIR',
+                        help="the directory of the artifact store")
+    parser.add_argument('--key', type=str, default=None,
+                        help="the design key of the run, lists the keys if missing")
+    parser.add_argument('--name', type=str, default='frd',
+                        help="the name of the artifact of the run")
+    parser.add_argument('--output', type=str, metavar='FILE', default=None,
+                        help="extract the artifact to this file")
+    args = parser.parse_args(args)
+
+    store = ArtifactStore(args.directory)
+    if args.key is None:
+        for key in store.get_keys():
+            print(key, ' '.join(store.get_names(key)))
+        stats = store.get_stats()
+        print("Stored {:.1f} MB of artifacts in {:.1f} MB".format(
+            stats['artifact_size'] / 1048576, stats['stored_size'] / 1048576))
+    elif args.output:
+        store.extract(args.key, args.name, args.output)
+    else:
+        with store.open(args.key, args.name) as file:
+            for name, (nodes, values) in read_frd_results(file).items():
+                print("{}: {} nodes, maximum {}".format(
+                    name, len(nodes), values.max(axis=0) if len(nodes) else None))
+    store.close()
+
+
+class _SectionReader(io.RawIOBase):
+    def __init__(self, paths: List[str]):
+        self.paths = list(paths)
+        self.file: Optional[BinaryIO] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while True:
+            if self.file is None:
+                if not self.paths:
+                    return 0
+                self.file = gzip.open(self.paths.pop(0), 'rb')
+            count = self.file.readinto(buffer)
+            if count:
+                return count
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        super().close()
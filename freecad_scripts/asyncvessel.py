@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, Iterable, List, Optional
+import asyncio
+import concurrent.futures
+import os
+
+from freecad_scripts.scheduler import get_shared_threads
+from freecad_scripts.worker import VesselWorker, WorkerError
+
+
+class AsyncPressureVessel(object):
+    """
+    An asyncio interface to a pool of worker processes that each have the
+    template open, for optimizers running in an event loop. Every worker
+    process has its own FreeCAD document, so evaluations run in parallel
+    without blocking the event loop. Cancelling an evaluation kills its
+    worker process, which is restarted for the next design.
+
+        async with AsyncPressureVessel('pv_capsule1.FCStd', workers=4) as vessel:
+            row = await vessel.evaluate({'thickness': 0.005, 'radius': 0.3})
+    """
+
+    def __init__(self, filename: str, workers: Optional[int] = None,
+                 defaults: Optional[Dict[str, Any]] = None,
+                 max_concurrency: Optional[int] = None,
+                 max_memory: Optional[int] = None, max_runs: Optional[int] = None,
+                 debug=False):
+        """
+        At most max_concurrency evaluations are in flight at the same time
+        (the number of workers by default), the others wait in order. The
+        cores are shared evenly between the solvers of the concurrent
+        evaluations, unless the defaults set the solver threads.
+        """
+        count = workers or os.cpu_count() or 1
+        defaults = dict(defaults or {})
+        if 'solver_threads' not in defaults:
+            defaults['solver_threads'] = get_shared_threads(
+                min(count, max_concurrency or count))
+        self.workers = [VesselWorker(filename, defaults=defaults,
+                                     max_memory=max_memory, max_runs=max_runs,
+                                     debug=debug) for _ in range(count)]
+        self.max_concurrency = max_concurrency or count
+        self.executor = concurrent.futures.ThreadPoolExecutor(count)
+        self.idle: Optional[asyncio.Queue] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.starting: Optional[asyncio.Future] = None
+
+    @property
+    def sketch_params(self) -> List[str]:
+        return self.workers[0].sketch_params
+
+    @property
+    def fieldnames(self) -> List[str]:
+        return self.workers[0].fieldnames
+
+    async def start(self):
+        """
+        Opens the template in all worker processes in parallel.
+        """
+        if self.idle is not None:
+            return
+        if self.starting is None:
+            self.starting = asyncio.ensure_future(self._start())
+        try:
+            await asyncio.shield(self.starting)
+        except WorkerError:
+            self.starting = None
+            raise
+
+    async def _start(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, worker.start)
+                               for worker in self.workers])
+        self.idle = asyncio.Queue()
+        for worker in self.workers:
+            self.idle.put_nowait(worker)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, worker.stop)
+                               for worker in self.workers])
+        self.executor.shutdown()
+        self.idle = None
+        self.starting = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def call(self, method: str, *args) -> Any:
+        """
+        Calls the given method of the PressureVessel object in an idle worker
+        process, see VesselWorker.call.
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            worker = await self.idle.get()
+            try:
+                future = loop.run_in_executor(self.executor, worker.call, method, *args)
+                try:
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # the worker is busy with the design, so kill it and
+                    # wait until the blocked call notices
+                    process = worker.process
+                    if process is not None and process.is_alive():
+                        process.kill()
+                    try:
+                        await future
+                    except WorkerError:
+                        pass
+                    raise
+            finally:
+                self.idle.put_nowait(worker)
+
+    async def evaluate(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Evaluates a single design and returns its row of parameters and
+        outputs. Errors are recorded in the error field of the row.
+        """
+        try:
+            row = await self.call('evaluate', params)
+            row['error'] = ''
+        except WorkerError as err:
+            row = dict(params)
+            row['error'] = str(err)
+        return row
+
+    async def evaluate_many(self, designs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Evaluates a batch of designs concurrently and returns their rows in
+        the order of the designs.
+        """
+        return list(await asyncio.gather(*[self.evaluate(params) for params in designs]))
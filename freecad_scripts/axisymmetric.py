@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, List, Set
+import os
+import shutil
+import tempfile
+
+from freecad_scripts.frdreader import get_result_summary
+from freecad_scripts.libs import FreeCAD, Part, ObjectsFem, GmshTools, \
+    FemToolsCcx
+from freecad_scripts.profiling import get_child_time
+
+
+class AxisymmetricModel(object):
+    """
+    Solves a revolved pressure vessel as a 2D axisymmetric CalculiX model
+    built from the profile of the Sketch. The profile is meshed with second
+    order triangles, the pressure and fixed constraints of the 3D model are
+    transferred to the profile edges whose revolution lies on the constrained
+    faces. Uses the same units as the FreeCAD writer (mm, N, MPa).
+    """
+
+    def __init__(self, vessel):
+        self.vessel = vessel
+        self.doc = vessel.doc
+        self.debug = vessel.debug
+
+        revolution = self.doc.getObject('Revolution')
+        axis = revolution.ReferenceAxis
+        if axis is None or axis[0].Name != 'Sketch' or \
+                axis[1][0] not in ['H_Axis', 'V_Axis']:
+            raise ValueError("Revolution must be around a sketch axis")
+        if abs(float(revolution.Angle.getValueAs('deg')) - 360.0) > 1e-9:
+            raise ValueError("Revolution must be a full revolution")
+
+        # index of the axial coordinate in the sketch plane
+        self.axis = 0 if axis[1][0] == 'H_Axis' else 1
+
+        self.face_obj = self.doc.getObject('AxisymmetricFace')
+        if self.face_obj is None:
+            self.face_obj = self.doc.addObject('Part::Feature', 'AxisymmetricFace')
+            self.face_obj.Visibility = False
+
+        self.mesh_key = None
+        self.mesh_obj = self.doc.getObject('AxisymmetricMesh')
+        if self.mesh_obj is None:
+            self.mesh_obj = ObjectsFem.makeMeshGmsh(self.doc, 'AxisymmetricMesh')
+            self.mesh_obj.Part = self.face_obj
+            self.mesh_obj.ElementDimension = '2D'
+            self.mesh_obj.ElementOrder = '2nd'
+            self.mesh_obj.Visibility = False
+
+    def get_profile(self) -> Part.Face:
+        sketch = self.doc.getObject('Sketch')
+        edges = Part.__sortEdges__(sketch.Shape.Edges)
+        return Part.Face(Part.Wire(edges))
+
+    def to_plane(self, point: FreeCAD.Vector) -> FreeCAD.Vector:
+        """
+        Returns the radial and axial coordinates of a global point.
+        """
+        sketch = self.doc.getObject('Sketch')
+        local = sketch.getGlobalPlacement().inverse().multVec(point)
+        if self.axis == 0:
+            return FreeCAD.Vector(abs(local.y), local.x, 0.0)
+        else:
+            return FreeCAD.Vector(abs(local.x), local.y, 0.0)
+
+    @staticmethod
+    def get_constraint_shape(obj) -> Part.Shape:
+        faces = []
+        for ref, subnames in obj.References:
+            for name in subnames:
+                faces.append(ref.Shape.getElement(name))
+        return Part.makeCompound(faces)
+
+    def get_edge_nodes(self, constraint: str) -> Set[int]:
+        """
+        Returns the mesh nodes on the profile edges that lie on the faces
+        of the given constraint.
+        """
+        shape = self.get_constraint_shape(self.doc.getObject(constraint))
+        mesh = self.mesh_obj.FemMesh
+        nodes = set()
+        for edge in self.face_obj.Shape.Edges:
+            param = 0.5 * (edge.FirstParameter + edge.LastParameter)
+            vertex = Part.Vertex(edge.valueAt(param))
+            if shape.distToShape(vertex)[0] < 1e-3:
+                nodes.update(mesh.getNodesByEdge(edge))
+        return nodes
+
+    def create_mesh(self):
+        mesh_key = self.vessel.get_mesh_key()
+        if mesh_key == self.mesh_key:
+            return
+
+        self.mesh_key = None
+        self.face_obj.Shape = self.get_profile()
+        mesh_length = self.doc.getObject('FEMMeshGmsh').CharacteristicLengthMax
+        self.mesh_obj.CharacteristicLengthMax = mesh_length
+
+        if self.debug:
+            print("Running axisymmetric GMSH mesher ...", end=' ', flush=True)
+        mesher = GmshTools(self.mesh_obj)
+        child_start = get_child_time()
+        err = mesher.create_mesh()
+        self.vessel.add_child_time('gmsh', child_start)
+        if err:
+            raise ValueError(err)
+        self.mesh_key = mesh_key
+        mesh = self.mesh_obj.FemMesh
+        if self.debug:
+            print(mesh.NodeCount, "nodes,", mesh.FaceCount, "faces")
+
+    def get_elements(self) -> List[List[int]]:
+        """
+        Returns the node lists of all triangles oriented counterclockwise
+        in the radial-axial plane.
+        """
+        mesh = self.mesh_obj.FemMesh
+        elements = []
+        for elem in mesh.Faces:
+            nodes = list(mesh.getElementNodes(elem))
+            a, b, c = [self.to_plane(mesh.getNodeById(n)) for n in nodes[:3]]
+            if (b - a).cross(c - a).z < 0.0:
+                nodes = [nodes[0], nodes[2], nodes[1],
+                         nodes[5], nodes[4], nodes[3]]
+            elements.append(nodes)
+        return elements
+
+    def write_inp_file(self, filename: str):
+        mesh = self.mesh_obj.FemMesh
+        elements = self.get_elements()
+        pressure_nodes = self.get_edge_nodes('ConstraintPressure')
+        fixed_nodes = self.get_edge_nodes('ConstraintFixed')
+        if not pressure_nodes or not fixed_nodes:
+            raise ValueError("Constraints are not on the revolved profile")
+
+        pressure = self.doc.getObject('ConstraintPressure')
+        sign = -1.0 if pressure.Reversed else 1.0
+
+        with open(filename, 'w') as file:
+            file.write('*NODE, NSET=NALL\n')
+            for node, point in mesh.Nodes.items():
+                point = self.to_plane(point)
+                file.write('{}, {:.13e}, {:.13e}\n'.format(node, point.x, point.y))
+
+            file.write('*ELEMENT, TYPE=CAX6, ELSET=EALL\n')
+            for elem, nodes in enumerate(elements, 1):
+                file.write('{}, {}\n'.format(elem, ', '.join(map(str, nodes))))
+
+            file.write('*MATERIAL, NAME=MATERIAL\n')
+            file.write('*ELASTIC\n{:.13e}, {:.13e}\n'.format(
+                self.vessel.get_youngs_modulus(), self.vessel.get_poisson_ratio()))
+            file.write('*SOLID SECTION, ELSET=EALL, MATERIAL=MATERIAL\n')
+
+            file.write('*STEP\n*STATIC{}\n'.format(self.vessel.get_solver_keyword()))
+            file.write('*BOUNDARY\n')
+            for node in sorted(fixed_nodes):
+                file.write('{}, 1, 2\n'.format(node))
+            for node, point in mesh.Nodes.items():
+                if node not in fixed_nodes and abs(self.to_plane(point).x) < 1e-6:
+                    file.write('{}, 1\n'.format(node))
+
+            file.write('*DLOAD\n')
+            for elem, nodes in enumerate(elements, 1):
+                for side in range(3):
+                    if nodes[side] in pressure_nodes and \
+                            nodes[(side + 1) % 3] in pressure_nodes and \
+                            nodes[side + 3] in pressure_nodes:
+                        file.write('{}, P{}, {:.13e}\n'.format(
+                            elem, side + 1, sign * self.vessel.get_pressure()))
+
+            file.write('*NODE FILE\nU\n*EL FILE\nS\n*END STEP\n')
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Meshes and solves the axisymmetric model of the current design and
+        returns its mesh properties and analysis outputs.
+        """
+        self.create_mesh()
+
+        fea = FemToolsCcx(
+            self.doc.getObject('Analysis'),
+            self.doc.getObject('SolverCcxTools'))
+        fea.setup_ccx()
+
+        if self.debug:
+            print("Running axisymmetric FEM analysis ...", end=' ', flush=True)
+        working_dir = tempfile.mkdtemp(prefix='axisymmetric_',
+                                       dir=self.vessel.acquire_working_dir())
+        try:
+            self.write_inp_file(os.path.join(working_dir, 'axisymmetric.inp'))
+            self.vessel.run_ccx(fea.ccx_binary, working_dir, 'axisymmetric')
+            results = get_result_summary(
+                os.path.join(working_dir, 'axisymmetric.frd'))
+            self.vessel.archive_files(
+                os.path.join(working_dir, 'axisymmetric'), 'axisymmetric.')
+        finally:
+            shutil.rmtree(working_dir, ignore_errors=True)
+
+        mesh = self.mesh_obj.FemMesh
+        results.update({
+            'node_count': mesh.NodeCount,
+            'edge_count': mesh.EdgeCount,
+            'face_count': mesh.FaceCount,
+            'volume_count': mesh.VolumeCount,
+        })
+        if self.debug:
+            print("vonMises stress: {:.2f} MPa".format(results['vonmises_stress']))
+        return results
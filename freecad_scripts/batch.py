@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+import os
+import threading
+import time
+
+from freecad_scripts.metrics import StudyMetrics
+from freecad_scripts.scheduler import CoreScheduler, get_shared_threads
+from freecad_scripts.study import group_items, shard_designs, shard_items, \
+    csv_open_output, csv_close_output
+from freecad_scripts.worker import VesselWorker, WorkerError
+
+
+class BatchStudy(object):
+    """
+    The designs of one template in a batch and their scheduling state.
+    """
+
+    def __init__(self, template: str, designs: Union[
+            Iterable[Dict[str, Any]], Callable[[List[str]], Iterable[Dict[str, Any]]]],
+            indexed=False):
+        self.template = template
+        self.designs = designs
+        self.indexed = indexed
+        self.items: List[Tuple[int, Dict[str, Any]]] = []
+        self.rejected: List[Tuple[int, Dict[str, Any], str]] = []
+        self.fieldnames: List[str] = []
+        self.position = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def has_pending(self) -> bool:
+        return self.position < len(self.items)
+
+
+class BatchRunner(object):
+    """
+    Runs the studies of several templates on one shared pool of worker
+    processes. Each worker process has one template open at a time, a free
+    worker is given a design of the template with the fewest running jobs,
+    preferring its current template to avoid reopening. This way every
+    template gets a fair share of the pool, and workers finishing the tail of
+    one study move on to the others. The rows are written to a single output
+    tagged with the template and the design index.
+    """
+
+    def __init__(self, jobs: Optional[int] = None,
+                 defaults: Optional[Dict[str, Any]] = None,
+                 max_memory: Optional[int] = None, max_runs: Optional[int] = None,
+                 metrics: Optional[StudyMetrics] = None,
+                 shard: Tuple[int, int] = (0, 1),
+                 scheduler: Optional[CoreScheduler] = None, debug=False):
+        """
+        If shard is given as (i, n), then only the designs of each template
+        whose index is i modulo n are run. If scheduler is given, then the
+        solver threads of each design are chosen by its predicted size, and
+        designs wait until enough cores are free. The number of workers
+        defaults to the number of cores in this case. Otherwise the cores are
+        shared evenly between the solvers of the workers, unless the defaults
+        set the solver threads.
+        """
+        if scheduler is not None:
+            jobs = jobs or scheduler.cores
+        self.jobs = jobs or os.cpu_count() or 1
+        self.scheduler = scheduler
+        self.defaults = dict(defaults or {})
+        if scheduler is None and 'solver_threads' not in self.defaults:
+            self.defaults['solver_threads'] = get_shared_threads(self.jobs)
+        self.max_memory = max_memory
+        self.max_runs = max_runs
+        self.metrics = metrics
+        self.shard = shard
+        self.debug = debug
+        self.studies: List[BatchStudy] = []
+        self.lock = threading.Lock()
+
+    def add(self, template: str, designs: Union[
+            Iterable[Dict[str, Any]], Callable[[List[str]], Iterable[Dict[str, Any]]]],
+            indexed=False):
+        """
+        Adds the designs of the given template to the batch. The designs can
+        also be given as a function of the sketch parameters of the template,
+        e.g. to generate random designs. If indexed is set, then the designs
+        are given as (index, params) pairs, e.g. read from a design file.
+        """
+        self.studies.append(BatchStudy(template, designs, indexed))
+
+    def create_worker(self, template: str) -> VesselWorker:
+        return VesselWorker(template, defaults=self.defaults,
+                            max_memory=self.max_memory, max_runs=self.max_runs,
+                            debug=self.debug)
+
+    def prepare(self, group=False, check=False) -> List[VesselWorker]:
+        """
+        Opens every template once to read its output columns and to generate,
+        group and check its designs. Returns the opened workers, at most as
+        many as the size of the pool.
+        """
+        workers = []
+        for study in self.studies:
+            worker = self.create_worker(study.template)
+            try:
+                worker.start()
+            except WorkerError:
+                for other in workers:
+                    other.stop()
+                raise
+            study.fieldnames = worker.fieldnames
+
+            designs = study.designs
+            if callable(designs):
+                designs = designs(worker.sketch_params)
+            if study.indexed:
+                items = shard_items(designs, self.shard)
+            else:
+                items = shard_designs(designs, self.shard)
+            if group:
+                items = group_items(items, worker.sketch_params)
+            else:
+                items = list(items)
+            if check and worker.feasibility is not None:
+                items, study.rejected = worker.feasibility.split(items)
+            study.items = items
+
+            if len(workers) < self.jobs:
+                workers.append(worker)
+            else:
+                worker.stop()
+        return workers
+
+    def get_fieldnames(self) -> List[str]:
+        """
+        Returns the union of the output columns of all templates, so each
+        template has its own sketch parameter columns.
+        """
+        fieldnames = ['template', 'index']
+        for study in self.studies:
+            for name in study.fieldnames:
+                if name not in fieldnames:
+                    fieldnames.append(name)
+        return fieldnames + ['error']
+
+    def next_job(self, current: Optional[str]) -> Optional[
+            Tuple[BatchStudy, int, Dict[str, Any]]]:
+        with self.lock:
+            pending = [s for s in self.studies if s.has_pending()]
+            if not pending:
+                return None
+            study = min(pending, key=lambda s: (
+                s.running, s.template != current, s.position))
+            index, params = study.items[study.position]
+            study.position += 1
+            study.running += 1
+        return study, index, params
+
+    def update_queue_depth(self):
+        if self.metrics is None:
+            return
+        with self.lock:
+            pending = sum(len(study.items) - study.position for study in self.studies)
+            running = sum(study.running for study in self.studies)
+        self.metrics.set_queue_depth({'pending': pending, 'running': running})
+
+    def write_row(self, writer, study: BatchStudy, index: int, row: Dict[str, Any]):
+        row['template'] = study.template
+        row['index'] = index
+        with self.lock:
+            writer.writerow({name: row.get(name, '') for name in writer.fieldnames})
+
+    def run_worker(self, worker: Optional[VesselWorker], writer):
+        try:
+            while True:
+                job = self.next_job(None if worker is None else worker.filename)
+                if job is None:
+                    break
+                study, index, params = job
+                self.update_queue_depth()
+
+                if worker is None or worker.filename != study.template:
+                    if worker is not None:
+                        worker.stop()
+                    worker = self.create_worker(study.template)
+
+                start = time.perf_counter()
+                try:
+                    if self.scheduler is None:
+                        row = worker.evaluate(params)
+                    else:
+                        row = self.evaluate_scheduled(worker, params)
+                    row['error'] = ''
+                    failed = False
+                except WorkerError as err:
+                    row = dict(params)
+                    row['error'] = str(err)
+                    failed = True
+
+                self.write_row(writer, study, index, row)
+                with self.lock:
+                    study.running -= 1
+                    study.completed += 1
+                    study.failed += failed
+                self.update_queue_depth()
+                if self.metrics is not None:
+                    self.metrics.record(time.perf_counter() - start, row['error'],
+                                        worker.timings, worker.cache_hits)
+                if self.debug:
+                    print("Design {} of {} done, {} of {} finished".format(
+                        index, study.template, study.completed, len(study.items)))
+        finally:
+            if worker is not None:
+                worker.stop()
+
+    def evaluate_scheduled(self, worker: VesselWorker,
+                           params: Dict[str, Any]) -> Dict[str, Any]:
+        row, threads = self.scheduler.call(worker, 'evaluate', params)
+        if self.debug:
+            print("Ran design with {} threads and {} nodes".format(
+                threads, row.get('node_count')))
+        return row
+
+    def run(self, output: str, group=False, check=False):
+        """
+        Evaluates the designs of all templates and writes their rows to the
+        output. The group and check options are applied to each template
+        separately, see StudyRunner.run.
+        """
+        workers = self.prepare(group=group, check=check)
+        workers.extend([None] * (self.jobs - len(workers)))
+
+        writer = csv_open_output(output, self.get_fieldnames())
+        try:
+            for study in self.studies:
+                for index, params, reason in study.rejected:
+                    row = dict(params, error='Infeasible: ' + reason)
+                    self.write_row(writer, study, index, row)
+                study.failed += len(study.rejected)
+                if self.metrics is not None:
+                    self.metrics.record_rejected(len(study.rejected))
+            if self.metrics is not None:
+                self.metrics.set_total(sum(len(study.items) + len(study.rejected)
+                                           for study in self.studies))
+                self.metrics.start()
+            self.update_queue_depth()
+
+            threads = [threading.Thread(target=self.run_worker, args=(worker, writer))
+                       for worker in workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            csv_close_output(writer)
+            for worker in workers:
+                if worker is not None:
+                    worker.stop()
+            if self.metrics is not None:
+                self.update_queue_depth()
+                self.metrics.stop()
+
+        if self.debug:
+            for study in self.studies:
+                print("Template {}: {} designs, {} failed".format(
+                    study.template, len(study.items) + len(study.rejected),
+                    study.failed))
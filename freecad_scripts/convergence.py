@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, List, Optional
+import csv
+import os
+
+import numpy
+
+
+def get_mesh_options(mesh_min: float, mesh_max: float, mesh_step: float) -> List[float]:
+    """
+    Returns the mesh lengths of a convergence sweep from coarse to fine.
+    """
+    return [round(float(x), 9)
+            for x in numpy.arange(mesh_min, mesh_max, mesh_step)[::-1]]
+
+
+class MeshIndex(object):
+    """
+    A spatial index of the converged mesh lengths of designs, keyed by the
+    logarithm of their sketch lengths so that distances measure relative
+    differences. The points are appended to a CSV file as they are added,
+    so the index survives restarts and can be shared between studies.
+    Nearest neighbors are found by a vectorized linear scan, which is fast
+    enough for the tens of thousands of points of a study.
+    """
+
+    def __init__(self, params: List[str], filename: Optional[str] = None):
+        self.params = list(params)
+        self.filename = filename
+        self.points = numpy.empty((0, len(self.params)))
+        self.mesh_lengths = numpy.empty(0)
+
+        if filename and os.path.exists(filename):
+            with open(filename, newline='', encoding='utf-8') as file:
+                rows = list(csv.DictReader(file))
+            if rows:
+                self.points = numpy.array(
+                    [self.get_key(row) for row in rows]).reshape(-1, len(self.params))
+                self.mesh_lengths = numpy.array(
+                    [float(row['mesh_length']) for row in rows])
+
+    def __len__(self) -> int:
+        return len(self.mesh_lengths)
+
+    def get_key(self, params: Dict[str, Any]) -> Optional[numpy.ndarray]:
+        if any(name not in params for name in self.params):
+            return None
+        return numpy.log(numpy.maximum(
+            [float(params[name]) for name in self.params], 1e-12))
+
+    def add(self, params: Dict[str, Any], mesh_length: float):
+        key = self.get_key(params)
+        if key is None:
+            return
+
+        self.points = numpy.vstack([self.points, key])
+        self.mesh_lengths = numpy.append(self.mesh_lengths, mesh_length)
+
+        if self.filename:
+            exists = os.path.exists(self.filename)
+            with open(self.filename, 'a', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                if not exists:
+                    writer.writerow(self.params + ['mesh_length'])
+                writer.writerow([params[name] for name in self.params] + [mesh_length])
+
+    def predict(self, params: Dict[str, Any], count: int = 3) -> Optional[float]:
+        """
+        Returns the median converged mesh length of the nearest designs, or
+        None if the index is empty.
+        """
+        key = self.get_key(params)
+        if key is None or not len(self):
+            return None
+
+        dists = numpy.linalg.norm(self.points - key, axis=1)
+        nearest = numpy.argsort(dists)[:count]
+        return float(numpy.median(self.mesh_lengths[nearest]))
+
+
+class MeshConvergence(object):
+    """
+    A mesh convergence sweep: designs are analyzed with the mesh lengths
+    from coarse to fine until the von Mises stress of the last window runs
+    has a coefficient of variation below the threshold. If a mesh index is
+    given, then the sweep starts window steps coarser than the converged
+    mesh length of the nearest designs.
+    """
+
+    def __init__(self, mesh_options: List[float], window: int = 6,
+                 threshold: float = 0.05, index: Optional[MeshIndex] = None):
+        self.mesh_options = list(mesh_options)
+        self.window = window
+        self.threshold = threshold
+        self.index = index
+
+    def get_start(self, params: Dict[str, Any]) -> int:
+        if self.index is None:
+            return 0
+        mesh_length = self.index.predict(params)
+        if mesh_length is None:
+            return 0
+
+        position = int(numpy.argmin(numpy.abs(
+            numpy.array(self.mesh_options) - mesh_length)))
+        return max(0, min(position - self.window,
+                          len(self.mesh_options) - self.window - 1))
+
+    def update(self, params: Dict[str, Any], row: Dict[str, Any]):
+        if self.index is not None and row.get('converged'):
+            self.index.add(params, row['mesh_length'])
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import List
+import csv
+import sys
+
+
+def csv_open_output(filename: str, fieldnames: List[str]) -> csv.DictWriter:
+    if filename == '-':
+        file = sys.stdout
+    else:
+        file = open(filename, 'w', newline='', encoding='utf-8')
+
+    writer = csv.DictWriter(file, fieldnames)
+    if filename != '-':
+        writer.file = file
+    writer.writeheader()
+    return writer
+
+
+def csv_close_output(writer: csv.DictWriter):
+    if hasattr(writer, 'file'):
+        writer.file.close()
+    else:
+        sys.stdout.flush()
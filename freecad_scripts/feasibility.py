@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy
+
+
+def get_sketch_dimensions(sketch) -> numpy.ndarray:
+    """
+    Returns the lengths of the line segments and the radii of the arcs and
+    circles of the sketch in meters.
+    """
+    dims = []
+    for geo in sketch.Geometry:
+        if hasattr(geo, 'Radius'):
+            dims.append(geo.Radius * 1e-3)
+        elif hasattr(geo, 'StartPoint') and hasattr(geo, 'EndPoint'):
+            dims.append(geo.StartPoint.distanceToPoint(geo.EndPoint) * 1e-3)
+        else:
+            dims.append(numpy.nan)
+    return numpy.array(dims)
+
+
+class FeasibilityChecker(object):
+    """
+    Checks whether design points can be set on the sketch without running
+    the sketch solver on them. Every line length and radius of the sketch is
+    an affine function of the named constraints, and all of these must stay
+    positive. For example the inner radius of a capsule is radius - thickness.
+    The affine functions are derived once from the template by perturbing
+    each named constraint, and then whole design arrays are checked at once.
+    """
+
+    def __init__(self, params: List[str], base: numpy.ndarray,
+                 coefficients: numpy.ndarray, constants: numpy.ndarray,
+                 tolerance: float = 1e-6):
+        """
+        Each row of the coefficients matrix and the constants vector define
+        the inequality constants[i] + coefficients[i] @ values > tolerance,
+        where values are the named constraints in meters. The base values are
+        used for the parameters that are missing from a design.
+        """
+        self.params = list(params)
+        self.base = numpy.asarray(base, dtype=float)
+        self.coefficients = numpy.asarray(coefficients, dtype=float)
+        self.constants = numpy.asarray(constants, dtype=float)
+        self.tolerance = tolerance
+
+    @classmethod
+    def from_vessel(cls, vessel, rel_step: float = 1e-3) -> 'FeasibilityChecker':
+        """
+        Derives the inequalities from the sketch of the given pressure vessel.
+        The named constraints are perturbed one by one and restored afterwards,
+        and dimensions that do not depend linearly on them are left out.
+        """
+        sketch = vessel.doc.getObject('Sketch')
+        params = list(vessel.sketch_params)
+        base = numpy.array([vessel.sketch_get_length(p) for p in params])
+        dims = get_sketch_dimensions(sketch)
+
+        rows = []
+        linear = numpy.isfinite(dims)
+        try:
+            for index, name in enumerate(params):
+                step = max(abs(base[index]) * rel_step, 1e-6)
+                vessel.sketch_set_length(name, base[index] + step)
+                upper = get_sketch_dimensions(sketch)
+                vessel.sketch_set_length(name, base[index] - step)
+                lower = get_sketch_dimensions(sketch)
+                vessel.sketch_set_length(name, base[index])
+
+                rows.append((upper - lower) / (2.0 * step))
+                linear &= numpy.abs(upper + lower - 2.0 * dims) <= 1e-9 + 1e-6 * abs(dims)
+        finally:
+            for index, name in enumerate(params):
+                vessel.sketch_set_length(name, base[index])
+
+        coefficients = numpy.array(rows).T.reshape(len(dims), len(params))
+        constants = dims - coefficients @ base
+        coefficients = coefficients[linear]
+        constants = constants[linear]
+
+        # round away the noise of the finite differences and remove duplicates
+        coefficients = numpy.round(coefficients, 6)
+        constants = numpy.round(constants, 9)
+        keys = numpy.hstack([coefficients, constants[:, numpy.newaxis]])
+        _, unique = numpy.unique(keys, axis=0, return_index=True)
+        unique.sort()
+        return cls(params, base, coefficients[unique], constants[unique])
+
+    def get_description(self, index: int) -> str:
+        """
+        Returns the inequality with the given index as a readable expression.
+        """
+        terms = []
+        for coef, name in sorted(zip(self.coefficients[index], self.params),
+                                 key=lambda term: term[0] < 0.0):
+            if coef == 0.0:
+                continue
+            sign = '-' if coef < 0.0 else '+'
+            if abs(coef) == 1.0:
+                terms.append('{} {}'.format(sign, name))
+            else:
+                terms.append('{} {:g}*{}'.format(sign, abs(coef), name))
+        if self.constants[index] != 0.0 or not terms:
+            const = self.constants[index]
+            terms.append('{} {:g}'.format('-' if const < 0.0 else '+', abs(const)))
+        expr = ' '.join(terms)
+        expr = expr[2:] if expr.startswith('+ ') else '-' + expr[2:]
+        return expr + ' > 0'
+
+    def get_descriptions(self) -> List[str]:
+        return [self.get_description(i) for i in range(len(self.constants))]
+
+    def check_array(self, values: numpy.ndarray, columns: List[str]) -> numpy.ndarray:
+        """
+        Checks the rows of the given design array whose columns are named by
+        columns (other columns are ignored). Returns the index of the first
+        violated inequality for each row, or -1 if the row is feasible.
+        """
+        values = numpy.atleast_2d(numpy.asarray(values, dtype=float))
+        design = numpy.tile(self.base, (values.shape[0], 1))
+        for index, name in enumerate(self.params):
+            if name in columns:
+                design[:, index] = values[:, columns.index(name)]
+
+        slack = design @ self.coefficients.T + self.constants
+        violated = slack <= self.tolerance
+        first = numpy.argmax(violated, axis=1)
+        return numpy.where(violated.any(axis=1), first, -1)
+
+    def check(self, designs: Iterable[Dict[str, Any]]) -> numpy.ndarray:
+        """
+        Checks a list of design dictionaries, see check_array.
+        """
+        values = numpy.array([[params.get(name, numpy.nan) for name in self.params]
+                              for params in designs], dtype=float)
+        values = values.reshape(-1, len(self.params))
+        values = numpy.where(numpy.isnan(values), self.base, values)
+        return self.check_array(values, self.params)
+
+    def split(self, designs: Iterable[Tuple[int, Dict[str, Any]]]) -> Tuple[
+            List[Tuple[int, Dict[str, Any]]], List[Tuple[int, Dict[str, Any], str]]]:
+        """
+        Splits the indexed designs into the feasible ones and the rejected
+        ones together with the inequality they violate.
+        """
+        designs = list(designs)
+        result = self.check(params for _, params in designs)
+        feasible = []
+        rejected = []
+        for (index, params), violated in zip(designs, result):
+            if violated < 0:
+                feasible.append((index, params))
+            else:
+                rejected.append((index, params, self.get_description(violated)))
+        return feasible, rejected
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import BinaryIO, Dict, List, Tuple, Union
+
+import numpy
+
+
+def get_vonmises_stresses(stress: numpy.ndarray) -> numpy.ndarray:
+    """
+    Returns the von Mises stresses of an array of stress vectors given as
+    sxx, syy, szz, sxy, syz, szx.
+    """
+    sxx, syy, szz, sxy, syz, szx = stress.T
+    return numpy.sqrt(0.5 * ((sxx - syy) ** 2 + (syy - szz) ** 2 + (szz - sxx) ** 2
+                             + 6.0 * (sxy ** 2 + syz ** 2 + szx ** 2)))
+
+
+def get_tresca_stresses(stress: numpy.ndarray) -> numpy.ndarray:
+    """
+    Returns the maximum shear stresses of an array of stress vectors given
+    as sxx, syy, szz, sxy, syz, szx.
+    """
+    sxx, syy, szz, sxy, syz, szx = stress.T
+    tensor = numpy.array([
+        [sxx, sxy, szx],
+        [sxy, syy, syz],
+        [szx, syz, szz]]).transpose(2, 0, 1)
+    principal = numpy.linalg.eigvalsh(tensor)
+    return 0.5 * (principal[:, 2] - principal[:, 0])
+
+
+def _parse_columns(lines: List[bytes]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # all records are on single lines of the same length
+    length = len(lines[0])
+    width = (length - 3) % 12
+    count = (length - 3 - width) // 12
+
+    chars = numpy.frombuffer(b''.join(lines), dtype='S1').reshape(
+        len(lines), length)
+    nodes = numpy.ascontiguousarray(chars[:, 3:3 + width]).view(
+        'S{}'.format(width)).ravel().astype(numpy.int64)
+    values = numpy.empty((len(lines), count))
+    for index in range(count):
+        start = 3 + width + 12 * index
+        values[:, index] = numpy.ascontiguousarray(
+            chars[:, start:start + 12]).view('S12').ravel().astype(float)
+    return nodes, values
+
+
+def _parse_records(lines: List[bytes], count: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # records continued on lines starting with -2
+    nodes = []
+    values = []
+    width = None
+    for line in lines:
+        if line.startswith(b' -1'):
+            if width is None:
+                width = (len(line) - 3) % 12
+            nodes.append(int(line[3:3 + width]))
+            start = 3 + width
+            values.append([])
+        else:
+            start = 3 + width
+        for pos in range(start, len(line) - 11, 12):
+            values[-1].append(float(line[pos:pos + 12]))
+    return (numpy.array(nodes, dtype=numpy.int64),
+            numpy.array(values, dtype=float).reshape(len(nodes), count))
+
+
+def read_frd_results(filename: Union[str, BinaryIO]) -> Dict[
+        str, Tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Reads the nodal result blocks of an ASCII CalculiX result file and
+    returns the node numbers and the value array of the last block of each
+    name (e.g. DISP and STRESS). The mesh blocks are skipped. The file can
+    also be given as a binary file object.
+    """
+    if isinstance(filename, str):
+        with open(filename, 'rb') as file:
+            data = file.read()
+    else:
+        data = filename.read()
+    data = data.replace(b'\r\n', b'\n')
+
+    results = dict()
+    pos = data.find(b'\n -4')
+    while pos >= 0:
+        end = data.index(b'\n', pos + 1)
+        header = data[pos + 1:end].split()
+        name = header[1].decode()
+        count = int(header[2])
+
+        start = end + 1
+        while data.startswith(b' -5', start):
+            if data[start:data.index(b'\n', start)].split()[1] == b'ALL':
+                count -= 1
+            start = data.index(b'\n', start) + 1
+
+        end = data.find(b'\n -3', start - 1)
+        lines = data[start:end].split(b'\n') if end >= start else []
+        if not lines:
+            results[name] = (numpy.empty(0, dtype=numpy.int64),
+                             numpy.empty((0, count)))
+        elif len(set(map(len, lines))) == 1 and \
+                not any(line.startswith(b' -2') for line in lines):
+            results[name] = _parse_columns(lines)
+        else:
+            results[name] = _parse_records(lines, count)
+        pos = data.find(b'\n -4', end)
+
+    return results
+
+
+def get_result_summary(filename: str) -> Dict[str, float]:
+    """
+    Returns the maximum von Mises and tresca stress in mega pascals and the
+    maximum displacement in meters from the given CalculiX result file of
+    a model in millimeters. A missing or unreadable result file, e.g. of a
+    failed solver run, raises a ValueError.
+    """
+    try:
+        results = read_frd_results(filename)
+    except (OSError, IndexError, ValueError) as err:
+        raise ValueError("FEM error: cannot read results from {}: {}".format(
+            filename, err))
+    if 'DISP' not in results or 'STRESS' not in results:
+        raise ValueError("FEM error: no results found in " + filename)
+
+    disp = results['DISP'][1][:, :3]
+    stress = results['STRESS'][1][:, :6]
+    return {
+        'vonmises_stress': float(get_vonmises_stresses(stress).max()),
+        'tresca_stress': float(get_tresca_stresses(stress).max()),
+        'max_displacement': float(numpy.linalg.norm(disp, axis=1).max()) * 1e-3,
+    }
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, List, Tuple
+import math
+
+
+class InpTemplate(object):
+    """
+    A CalculiX input deck written by the FreeCAD writer, split into keyword
+    blocks. The mesh, set and boundary blocks are kept as they are, only the
+    data lines of the *ELASTIC, *DENSITY and *DLOAD blocks are regenerated,
+    using the same number formats as the FreeCAD 0.19 writer.
+    """
+
+    def __init__(self, key: Any, text: str, basename: str):
+        """
+        The key identifies the geometry and mesh the deck was written for,
+        and basename is the name of the input file in the working directory.
+        """
+        self.key = key
+        self.basename = basename
+        self.blocks: List[Tuple[str, List[str]]] = []
+
+        keyword = ''
+        lines = []
+        for line in text.splitlines(keepends=True):
+            if line.startswith('*') and not line.startswith('**'):
+                self.blocks.append((keyword, lines))
+                keyword = line.split(',')[0].strip().upper()
+                lines = []
+            lines.append(line)
+        self.blocks.append((keyword, lines))
+
+    @staticmethod
+    def strip_comments(text: str) -> List[str]:
+        """
+        Returns the lines of the deck without the ** comments, which include
+        the time stamp in the footer of the FreeCAD writer.
+        """
+        return [line for line in text.splitlines() if not line.startswith('**')]
+
+    def matches(self, text: str, other: str) -> bool:
+        """
+        Returns True if the two decks differ only in their comments.
+        """
+        return self.strip_comments(text) == self.strip_comments(other)
+
+    @staticmethod
+    def is_data(line: str) -> bool:
+        return not line.startswith('*') and line.strip() != ''
+
+    def patch(self, youngs_modulus: float, poisson_ratio: float,
+              density: float, pressure: float) -> str:
+        """
+        Returns the input deck for the given material (in MPa and kg/m^3)
+        and pressure (in MPa). The sign of each pressure load is kept.
+        """
+        output = []
+        for keyword, lines in self.blocks:
+            if keyword == '*ELASTIC':
+                lines = [
+                    '{0:.0f}, {1:.3f}\n'.format(youngs_modulus, poisson_ratio)
+                    if self.is_data(line) else line for line in lines]
+            elif keyword == '*DENSITY':
+                lines = [
+                    '{0:.3e}\n'.format(density * 1e-12)
+                    if self.is_data(line) else line for line in lines]
+            elif keyword == '*DLOAD':
+                lines = [self.patch_dload(line, pressure)
+                         if self.is_data(line) else line for line in lines]
+            output.extend(lines)
+        return ''.join(output)
+
+    @staticmethod
+    def patch_dload(line: str, pressure: float) -> str:
+        fields = line.rstrip('\n').split(',')
+        sign = math.copysign(1.0, float(fields[-1]))
+        fields[-1] = '{}'.format(sign * pressure)
+        return ','.join(fields) + '\n'
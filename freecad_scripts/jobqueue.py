@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from freecad_scripts.metrics import StudyMetrics
+from freecad_scripts.scheduler import CoreScheduler
+from freecad_scripts.study import csv_open_output, csv_close_output
+from freecad_scripts.worker import VesselWorker, WorkerError
+
+
+class JobQueue(object):
+    """
+    A file backed queue of design points that can be shared between worker
+    processes on several machines through a shared filesystem. Workers claim
+    jobs with a lease, and jobs whose lease expired (because their worker
+    died) are put back into the queue. The rollback journal of SQLite is used
+    since the write ahead log does not work on network filesystems.
+    """
+
+    def __init__(self, filename: str, lease_time: float = 3600.0,
+                 max_attempts: int = 3):
+        self.filename = filename
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+
+        self.conn = sqlite3.connect(filename, timeout=600.0,
+                                    isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        with self.transaction():
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY, value TEXT)""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idx INTEGER NOT NULL,
+                params TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT)""")
+            self.conn.execute("""CREATE INDEX IF NOT EXISTS jobs_state
+                ON jobs (state, id)""")
+
+    def close(self):
+        self.conn.close()
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+    def set_meta(self, key: str, value: Any):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                          (key, json.dumps(value)))
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?',
+                                (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def submit(self, template: str, fieldnames: List[str],
+               designs: Iterable[Tuple[int, Dict[str, Any]]],
+               defaults: Optional[Dict[str, Any]] = None,
+               rejected: Iterable[Tuple[int, Dict[str, Any], str]] = ()) -> int:
+        """
+        Adds the given indexed designs of the template to the queue and returns
+        the number of new jobs. Jobs are claimed in the order they are given,
+        the indices are relative to the designs already in the queue. The
+        rejected designs are stored as failed jobs with the given error. The
+        template should be on the shared filesystem, its absolute path is
+        stored so that workers on other machines find it.
+        """
+        count = 0
+        with self.transaction():
+            template = os.path.abspath(template)
+            if self.get_meta('template', template) != template:
+                raise ValueError("Queue already has jobs for template "
+                                 + self.get_meta('template'))
+            self.set_meta('template', template)
+            self.set_meta('fieldnames', fieldnames)
+            self.set_meta('defaults', defaults or {})
+
+            start = self.conn.execute(
+                'SELECT COALESCE(MAX(idx) + 1, 0) FROM jobs').fetchone()[0]
+            for index, params in designs:
+                self.conn.execute('INSERT INTO jobs (idx, params) VALUES (?, ?)',
+                                  (start + index, json.dumps(params)))
+                count += 1
+            for index, params, error in rejected:
+                self.conn.execute("""INSERT INTO jobs (idx, params, state, error)
+                    VALUES (?, ?, 'failed', ?)""", (start + index, json.dumps(params), error))
+        return count
+
+    def _requeue_expired(self, now: float) -> int:
+        self.conn.execute("""UPDATE jobs SET state = 'failed',
+            error = 'WorkerError: lease expired too many times'
+            WHERE state = 'running' AND lease_until < ? AND attempts >= ?""",
+                          (now, self.max_attempts))
+        return self.conn.execute("""UPDATE jobs SET state = 'pending',
+            worker = NULL, lease_until = NULL
+            WHERE state = 'running' AND lease_until < ?""", (now,)).rowcount
+
+    def requeue_expired(self) -> int:
+        """
+        Puts the jobs of dead workers back into the queue and returns their
+        number. This is also done automatically when claiming jobs.
+        """
+        with self.transaction():
+            return self._requeue_expired(time.time())
+
+    def claim(self, worker: str) -> Optional[Tuple[int, int, Dict[str, Any]]]:
+        """
+        Leases the next pending job to the given worker and returns its job id,
+        design index and parameters, or None if there are no pending jobs.
+        """
+        with self.transaction():
+            now = time.time()
+            self._requeue_expired(now)
+            row = self.conn.execute("""SELECT id, idx, params FROM jobs
+                WHERE state = 'pending' ORDER BY id LIMIT 1""").fetchone()
+            if row is None:
+                return None
+            self.conn.execute("""UPDATE jobs SET state = 'running', worker = ?,
+                lease_until = ?, attempts = attempts + 1 WHERE id = ?""",
+                              (worker, now + self.lease_time, row[0]))
+        return row[0], row[1], json.loads(row[2])
+
+    def renew(self, job: int, worker: str) -> bool:
+        """
+        Extends the lease of a running job, returns False if the lease was lost.
+        """
+        with self.transaction():
+            return self.conn.execute("""UPDATE jobs SET lease_until = ?
+                WHERE id = ? AND worker = ? AND state = 'running'""",
+                                     (time.time() + self.lease_time, job, worker)).rowcount > 0
+
+    def complete(self, job: int, worker: str, row: Dict[str, Any]) -> bool:
+        """
+        Stores the output row of a job leased to the given worker. Returns
+        False if the lease was lost, in which case the row is dropped.
+        """
+        with self.transaction():
+            return self.conn.execute("""UPDATE jobs SET state = 'done', result = ?,
+                error = NULL, lease_until = NULL
+                WHERE id = ? AND worker = ? AND state = 'running'""",
+                                     (json.dumps(row), job, worker)).rowcount > 0
+
+    def fail(self, job: int, worker: str, error: str) -> bool:
+        """
+        Marks a job leased to the given worker as failed. Returns False if the
+        lease was lost, in which case the job is left to its new worker.
+        """
+        with self.transaction():
+            return self.conn.execute("""UPDATE jobs SET state = 'failed', error = ?,
+                lease_until = NULL WHERE id = ? AND worker = ? AND state = 'running'""",
+                                     (error, job, worker)).rowcount > 0
+
+    def get_counts(self) -> Dict[str, int]:
+        counts = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        for state, count in self.conn.execute(
+                'SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+            counts[state] = count
+        return counts
+
+    def get_results(self) -> Iterator[Dict[str, Any]]:
+        """
+        Returns the output rows of all finished jobs in design order. Failed
+        jobs are returned with their parameters and error message.
+        """
+        cursor = self.conn.execute("""SELECT idx, params, result, error FROM jobs
+            WHERE state IN ('done', 'failed') ORDER BY idx""")
+        for index, params, result, error in cursor:
+            row = json.loads(result) if result is not None else json.loads(params)
+            row['index'] = index
+            row['error'] = error or ''
+            yield row
+
+    def export(self, output: str):
+        fieldnames = ['index'] + self.get_meta('fieldnames', []) + ['error']
+        writer = csv_open_output(output, fieldnames)
+        for row in self.get_results():
+            writer.writerow({name: row.get(name, '') for name in fieldnames})
+        csv_close_output(writer)
+
+
+class _Transaction(object):
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+
+
+class QueueWorker(object):
+    """
+    Claims jobs from a queue and runs them on a recycled worker process until
+    the queue is empty. A background thread renews the lease of the running
+    job, so only jobs of dead workers expire.
+    """
+
+    def __init__(self, queue: JobQueue, max_memory: Optional[int] = None,
+                 max_runs: Optional[int] = None, wait: float = 0.0,
+                 metrics: Optional[StudyMetrics] = None,
+                 scheduler: Optional[CoreScheduler] = None, debug=False):
+        """
+        If wait is positive, then the worker polls an empty queue for this
+        many seconds before exiting, so it can pick up newly submitted jobs.
+        If metrics is given, then the jobs of this worker and the depth of
+        the queue are recorded there. If scheduler is given, then the solver
+        threads of each job are chosen by its predicted size.
+        """
+        self.queue = queue
+        self.wait = wait
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.debug = debug
+        self.name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.max_memory = max_memory
+        self.max_runs = max_runs
+        self.worker: Optional[VesselWorker] = None
+
+    def get_worker(self) -> VesselWorker:
+        """
+        Returns the worker process for the template and defaults of the
+        queue. They are read when a job is claimed, since the worker may be
+        started before the study is submitted.
+        """
+        template = self.queue.get_meta('template')
+        defaults = self.queue.get_meta('defaults', {})
+        worker = self.worker
+        if worker is None or worker.filename != template or worker.defaults != defaults:
+            if worker is not None:
+                worker.stop()
+            self.worker = VesselWorker(template, defaults=defaults,
+                                       max_memory=self.max_memory,
+                                       max_runs=self.max_runs, debug=self.debug)
+        return self.worker
+
+    def _renew_leases(self, job: int, stop: threading.Event, lost: threading.Event):
+        queue = JobQueue(self.queue.filename, lease_time=self.queue.lease_time)
+        try:
+            while not stop.wait(self.queue.lease_time / 3):
+                if not queue.renew(job, self.name):
+                    lost.set()
+                    break
+        finally:
+            queue.close()
+
+    def run_job(self, job: int, index: int, params: Dict[str, Any]):
+        stop = threading.Event()
+        lost = threading.Event()
+        thread = threading.Thread(target=self._renew_leases, args=(job, stop, lost),
+                                  daemon=True)
+        thread.start()
+        start = time.perf_counter()
+        error = None
+        worker = self.get_worker()
+        try:
+            if self.scheduler is None:
+                row = worker.evaluate(params)
+            else:
+                row = self.scheduler.call(worker, 'evaluate', params)[0]
+        except WorkerError as err:
+            row = None
+            error = str(err)
+        finally:
+            stop.set()
+            thread.join()
+
+        # another worker may run the job since our lease expired
+        if lost.is_set():
+            stored = False
+        elif row is not None:
+            stored = self.queue.complete(job, self.name, row)
+        else:
+            stored = self.queue.fail(job, self.name, error)
+        if not stored:
+            if self.debug:
+                print("Worker", self.name, "lost the lease of design", index)
+            return
+
+        if self.metrics is not None:
+            counts = self.queue.get_counts()
+            self.metrics.set_queue_depth(counts)
+            self.metrics.set_total(sum(counts.values()))
+            self.metrics.record(time.perf_counter() - start, error,
+                                worker.timings, worker.cache_hits)
+
+    def run(self) -> int:
+        """
+        Runs jobs until the queue is empty and returns their number.
+        """
+        count = 0
+        idle_since = time.time()
+        if self.metrics is not None:
+            self.metrics.start()
+        try:
+            while True:
+                claimed = self.queue.claim(self.name)
+                if claimed is None:
+                    if self.metrics is not None:
+                        self.metrics.set_queue_depth(self.queue.get_counts())
+                    if time.time() - idle_since >= self.wait:
+                        break
+                    time.sleep(min(10.0, self.wait))
+                    continue
+
+                job, index, params = claimed
+                if self.debug:
+                    print("Worker", self.name, "running design", index)
+                self.run_job(job, index, params)
+                count += 1
+                idle_since = time.time()
+        finally:
+            if self.worker is not None:
+                self.worker.stop()
+            if self.metrics is not None:
+                self.metrics.stop()
+        return count
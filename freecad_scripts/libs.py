@@ -55,3 +55,5 @@ else:
 
 from femtools.ccxtools import FemToolsCcx   # noqa
 from femmesh.gmshtools import GmshTools     # noqa
+import ObjectsFem                           # noqa
+import Part                                 # noqa
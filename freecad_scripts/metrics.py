@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Deque, Dict, Optional
+import collections
+import json
+import os
+import threading
+import time
+
+
+def get_error_class(error: str) -> str:
+    """
+    Returns the class of an error message of a worker, e.g. ValueError for
+    'ValueError: FEM error: ...', and WorkerError for crashed workers.
+    """
+    name = error.split(':', 1)[0].strip()
+    return name if name.isidentifier() else 'WorkerError'
+
+
+class StudyMetrics(object):
+    """
+    Collects the throughput, the moving average latency of the analysis
+    stages, the failure classes, the cache hit rates and the queue depth of
+    a running study, and periodically rewrites them into a status file. The
+    file is written in the Prometheus text format if its name ends with
+    .prom, otherwise as JSON. Recording only updates a few counters. Between
+    start and stop a background thread rewrites the file once per interval,
+    so its ETA stays current during long designs or while waiting for jobs.
+    """
+
+    def __init__(self, filename: str, total: Optional[int] = None,
+                 interval: float = 30.0, window: int = 50):
+        """
+        The total number of designs is used for the ETA, the moving averages
+        and the recent throughput are computed over the last window designs.
+        """
+        self.filename = filename
+        self.total = total
+        self.interval = interval
+        self.alpha = 2.0 / (window + 1)
+        self.lock = threading.Lock()
+
+        self.start_time = time.time()
+        self.last_write = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.failures: Dict[str, int] = collections.Counter()
+        self.latency: Dict[str, float] = dict()
+        self.cache_hits: Dict[str, int] = collections.Counter()
+        self.cache_misses: Dict[str, int] = collections.Counter()
+        self.queue_depth: Dict[str, int] = dict()
+        self.finish_times: Deque[float] = collections.deque(maxlen=window)
+
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Starts rewriting the status file in a background thread. With a zero
+        interval the file is rewritten after every design instead.
+        """
+        if self.thread is not None or self.interval <= 0:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._write_periodically, daemon=True)
+        self.thread.start()
+
+    def _write_periodically(self):
+        while not self.stopping.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        """
+        Stops the background thread and writes the final status.
+        """
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        self.write()
+
+    def set_total(self, total: Optional[int]):
+        self.total = total
+
+    def update_average(self, stage: str, seconds: float):
+        if stage in self.latency:
+            self.latency[stage] += self.alpha * (seconds - self.latency[stage])
+        else:
+            self.latency[stage] = seconds
+
+    def record(self, seconds: float, error: Optional[str] = None,
+               timings: Optional[Dict[str, float]] = None,
+               cache: Optional[Dict[str, bool]] = None):
+        """
+        Records a finished design with its total time in seconds, its error
+        message if it failed, the time of its analysis stages and whether the
+        cached mesh and input deck could be used.
+        """
+        with self.lock:
+            self.finish_times.append(time.time())
+            if error:
+                self.failed += 1
+                self.failures[get_error_class(error)] += 1
+            else:
+                self.completed += 1
+            self.update_average('design', seconds)
+            for stage, value in (timings or {}).items():
+                self.update_average(stage, value)
+            for name, hit in (cache or {}).items():
+                if hit:
+                    self.cache_hits[name] += 1
+                else:
+                    self.cache_misses[name] += 1
+        self.maybe_write()
+
+    def record_rejected(self, count: int):
+        """
+        Records designs rejected without running them.
+        """
+        with self.lock:
+            self.failed += count
+            self.failures['Infeasible'] += count
+
+    def set_queue_depth(self, counts: Dict[str, int]):
+        with self.lock:
+            self.queue_depth = dict(counts)
+
+    def get_status(self) -> Dict[str, Any]:
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.start_time
+            finished = self.completed + self.failed
+
+            rate = None
+            if len(self.finish_times) >= 2 and self.finish_times[-1] > self.finish_times[0]:
+                rate = (len(self.finish_times) - 1) / \
+                    (self.finish_times[-1] - self.finish_times[0])
+            elif elapsed > 0.0 and finished:
+                rate = finished / elapsed
+
+            eta = None
+            if self.total is not None and rate:
+                eta = max(0, self.total - finished) / rate
+
+            cache_hit_rate = dict()
+            for name in set(self.cache_hits) | set(self.cache_misses):
+                count = self.cache_hits[name] + self.cache_misses[name]
+                cache_hit_rate[name] = self.cache_hits[name] / count
+
+            return {
+                'timestamp': now,
+                'elapsed_seconds': elapsed,
+                'total': self.total,
+                'completed': self.completed,
+                'failed': self.failed,
+                'failure_rate': self.failed / finished if finished else 0.0,
+                'failures': dict(self.failures),
+                'designs_per_hour': 3600.0 * rate if rate else 0.0,
+                'stage_seconds': dict(self.latency),
+                'cache_hit_rate': cache_hit_rate,
+                'queue_depth': dict(self.queue_depth),
+                'eta_seconds': eta,
+            }
+
+    @staticmethod
+    def format_prometheus(status: Dict[str, Any]) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, text: str, values: Dict[Any, Any],
+                   label: Optional[str] = None):
+            lines.append('# HELP freecad_study_{} {}'.format(name, text))
+            lines.append('# TYPE freecad_study_{} {}'.format(name, kind))
+            for key, value in values.items():
+                if value is None:
+                    continue
+                labels = '{{{}="{}"}}'.format(label, key) if label else ''
+                lines.append('freecad_study_{}{} {}'.format(name, labels, float(value)))
+
+        metric('designs_total', 'counter', "Number of finished designs.",
+               {'completed': status['completed'], 'failed': status['failed']}, 'status')
+        metric('failures_total', 'counter', "Number of failed designs by error class.",
+               status['failures'], 'class')
+        metric('designs_per_hour', 'gauge', "Recent throughput.",
+               {None: status['designs_per_hour']})
+        metric('stage_seconds', 'gauge', "Moving average latency of the analysis stages.",
+               status['stage_seconds'], 'stage')
+        metric('cache_hit_ratio', 'gauge', "Fraction of analyses reusing a cached result.",
+               status['cache_hit_rate'], 'cache')
+        metric('queue_depth', 'gauge', "Number of jobs in the queue by state.",
+               status['queue_depth'], 'state')
+        metric('eta_seconds', 'gauge', "Estimated time until the study finishes.",
+               {None: status['eta_seconds']})
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        """
+        Rewrites the status file atomically, so readers never see a partial file.
+        """
+        status = self.get_status()
+        if self.filename.endswith('.prom'):
+            text = self.format_prometheus(status)
+        else:
+            text = json.dumps(status, indent=2) + '\n'
+
+        temp = '{}.{}.{}.tmp'.format(self.filename, os.getpid(), threading.get_ident())
+        with open(temp, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(temp, self.filename)
+
+    def maybe_write(self):
+        with self.lock:
+            now = time.time()
+            if now - self.last_write < self.interval:
+                return
+            self.last_write = now
+        self.write()
@@ -14,11 +14,40 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Any
+from typing import Any, Dict, List, Optional, Tuple
+import atexit
 import csv
-import random
-import sys
+import multiprocessing
+import os
+import statistics
+import subprocess
+import time
 from freecad_scripts.libs import FreeCAD, Units, GmshTools, FemToolsCcx
+from freecad_scripts import batch, convergence, jobqueue, metrics, resultstore, \
+    scheduler, study
+from freecad_scripts.worker import VesselWorker, WorkerError
+from freecad_scripts.artifacts import ArtifactStore
+from freecad_scripts.axisymmetric import AxisymmetricModel
+from freecad_scripts.frdreader import get_result_summary
+from freecad_scripts.inpwriter import InpTemplate
+from freecad_scripts.profiling import Profiler, get_child_time
+from freecad_scripts.scratch import ScratchDir
+from freecad_scripts.sensitivity import Jacobian, SensitivityPool, DEFAULT_OUTPUTS, \
+    get_perturbed_designs, get_steps
+
+
+# density of sea water times gravity times the safety factor in N/m^3
+DEPTH_PRESSURE = 1027.0 * 9.8 * 1.5
+
+
+def get_ccx_errors(output: str, count: int = 20) -> str:
+    """
+    Returns the *ERROR messages of the CalculiX console output, or its last
+    lines if there are none.
+    """
+    lines = output.strip().splitlines()
+    errors = [line.strip() for line in lines if '*ERROR' in line]
+    return ' '.join(errors or [line.strip() for line in lines[-count:]])
 
 
 class PressureVessel(object):
@@ -49,6 +78,38 @@ class PressureVessel(object):
             if c.Name:
                 self.sketch_params.append(str(c.Name))
 
+        self.analysis_mode = '3d'
+        self.axisymmetric_model = None
+        self.axisymmetric_results = None
+
+        # read the result file directly instead of creating result objects
+        self.fast_results = True
+        self.mesh_key = None
+        self.solid_results = None
+
+        self.patch_inp = True
+        self.inp_template = None
+        self.inp_verified = False
+
+        # seconds spent in the stages of the last analysis and the caches used
+        self.timings: Dict[str, float] = dict()
+        self.child_times: Dict[str, float] = dict()
+        self.cache_hits: Dict[str, bool] = dict()
+        self.profiler = None
+
+        # keeps the solver files of every run if set
+        self.artifact_store = None
+
+        # number of CalculiX threads, 0 leaves it to FreeCAD
+        self.solver_threads = 0
+
+        # private working directory of the solver, None uses the FreeCAD one
+        self.scratch: Optional[ScratchDir] = ScratchDir()
+        atexit.register(self.close)
+
+        # worker processes evaluating the remeshed designs of sensitivities
+        self.sensitivity_pool: Optional[SensitivityPool] = None
+
     def print_info(self):
         """
         Prints out all relevant information from the design template
@@ -76,6 +137,7 @@ class PressureVessel(object):
         print("FEM parameters:")
         print("  pressure =", self.get_pressure(), "MPa")
         print("  mesh_length =", self.get_mesh_length(), "m")
+        print("  analysis_mode =", self.get_analysis_mode())
 
         print("Material parameters:")
         print("  youngs_modulus =", self.get_youngs_modulus(), "MPa")
@@ -101,6 +163,8 @@ class PressureVessel(object):
             print("  max_displacement = {} m".format(
                 self.get_max_displacement()))
             print("  has_failed =", self.get_has_failed())
+            if self.analysis_mode == 'validate':
+                print("  axisymmetric_error =", self.get_axisymmetric_error())
         else:
             print("FEM Results: none")
 
@@ -114,7 +178,10 @@ class PressureVessel(object):
         """
         Sets a length constraint of the sketch object in meters. This method
         may throw an exception if an internal constraint cannot be satisfied.
+        The sketch is not touched if the length does not change.
         """
+        if abs(self.sketch_get_length(param) - value) < 1e-12:
+            return
         obj = self.doc.getObject('Sketch')
         obj.setDatum(param, Units.Quantity(
             value * 1e3, Units.Unit('mm')))
@@ -130,6 +197,17 @@ class PressureVessel(object):
         obj = self.doc.getObject('ConstraintPressure')
         obj.Pressure = float(value)
 
+    def set_depth(self, value: float):
+        """
+        Sets the outside pressure to the pressure of sea water at the given
+        depth in meters with a safety factor of 1.5, as in the design point
+        files.
+        """
+        self.set_pressure(DEPTH_PRESSURE * float(value) * 1e-6)
+
+    def get_depth(self) -> float:
+        return self.get_pressure() * 1e6 / DEPTH_PRESSURE
+
     def get_pressure(self) -> float:
         obj = self.doc.getObject('ConstraintPressure')
         return float(obj.Pressure)
@@ -247,20 +325,281 @@ class PressureVessel(object):
             self.doc.removeObject('ResultMesh')
         if self.doc.getObject('ccx_dat_file'):
             self.doc.removeObject('ccx_dat_file')
+        self.solid_results = None
+        self.axisymmetric_results = None
+
+    def set_analysis_mode(self, value: str):
+        """
+        Selects the analysis to run: '3d' solves the full tetra mesh,
+        'axisymmetric' solves the 2D axisymmetric model of the revolved sketch
+        and 'validate' runs both and reports the 3D results together with the
+        relative error of the axisymmetric ones.
+        """
+        if value not in ['3d', 'axisymmetric', 'validate']:
+            raise ValueError("Unknown analysis mode: " + str(value))
+        self.analysis_mode = value
+
+    def get_analysis_mode(self) -> str:
+        return self.analysis_mode
+
+    def set_scratch_dir(self, value: str):
+        """
+        Selects the directory in which the private working directory of the
+        solver is created. The empty string selects /dev/shm if available,
+        'freecad' uses the working directory configured in FreeCAD and keeps
+        the files of the last run.
+        """
+        if self.scratch is not None:
+            self.scratch.close()
+        if value == 'freecad':
+            self.scratch = None
+        else:
+            self.scratch = ScratchDir(value or None)
+
+    def get_scratch_dir(self) -> str:
+        return 'freecad' if self.scratch is None else self.scratch.root
+
+    def acquire_working_dir(self) -> Optional[str]:
+        """
+        Returns the private working directory for the next run, or None if
+        the default temporary directory should be used.
+        """
+        return None if self.scratch is None else self.scratch.acquire()
+
+    def close(self):
+        """
+        Removes the working directories and closes the artifact store.
+        """
+        if self.scratch is not None:
+            self.scratch.close()
+        if self.artifact_store is not None:
+            self.artifact_store.close()
+            self.artifact_store = None
+        if self.sensitivity_pool is not None:
+            self.sensitivity_pool.close()
+            self.sensitivity_pool = None
+
+    def get_solver_types(self) -> List[str]:
+        """
+        Returns the matrix solvers supported by the CalculiX solver object.
+        """
+        obj = self.doc.getObject('SolverCcxTools')
+        return list(obj.getEnumerationsOfProperty('MatrixSolverType'))
+
+    def set_solver_type(self, value: str):
+        """
+        Selects the matrix solver of CalculiX, e.g. 'default', 'spooles',
+        'iterativescaling' or 'iterativecholesky'.
+        """
+        if value not in self.get_solver_types():
+            raise ValueError("Unknown solver type: " + str(value))
+        self.doc.getObject('SolverCcxTools').MatrixSolverType = value
+
+    def get_solver_type(self) -> str:
+        return str(self.doc.getObject('SolverCcxTools').MatrixSolverType)
+
+    def get_solver_keyword(self) -> str:
+        """
+        Returns the SOLVER option of the *STATIC card for the solver type.
+        """
+        return {
+            'spooles': ', SOLVER=SPOOLES',
+            'iterativescaling': ', SOLVER=ITERATIVE SCALING',
+            'iterativecholesky': ', SOLVER=ITERATIVE CHOLESKY',
+            'pardiso': ', SOLVER=PARDISO',
+        }.get(self.get_solver_type(), '')
+
+    def set_solver_threads(self, value: int):
+        """
+        Sets the number of threads of CalculiX, 0 leaves it to FreeCAD which
+        uses all cores unless configured otherwise.
+        """
+        if int(value) < 0:
+            raise ValueError("Invalid number of threads: " + str(value))
+        self.solver_threads = int(value)
+
+    def get_solver_threads(self) -> int:
+        return self.solver_threads
+
+    def set_solver(self, kind: str, threads: int = 0):
+        """
+        Selects the matrix solver and the number of threads of CalculiX.
+        """
+        self.set_solver_type(kind)
+        self.set_solver_threads(threads)
+
+    def run_ccx(self, binary: str, working_dir: str, jobname: str):
+        """
+        Runs CalculiX on the given input deck with the selected number of
+        threads, and raises a ValueError if it fails.
+        """
+        env = dict(os.environ)
+        if self.solver_threads:
+            env['OMP_NUM_THREADS'] = str(self.solver_threads)
+        child_start = get_child_time()
+        try:
+            # CalculiX prints its error messages on the standard output
+            subprocess.run([binary, '-i', jobname], cwd=working_dir, env=env,
+                           check=True, stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as err:
+            raise ValueError("FEM error: CalculiX exited with code {}: {}".format(
+                err.returncode, get_ccx_errors(err.stdout.decode(errors='replace'))))
+        finally:
+            self.add_child_time('ccx', child_start)
+
+    def autotune_solver(self, tolerance: float = 1e-3,
+                        threads: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Benchmarks the matrix solvers and thread counts on the current
+        design and selects the fastest one whose outputs are within the
+        relative tolerance of the default solver. The mesh is created once
+        and reused. Returns the selected solver_type and solver_threads.
+        """
+        if threads is None:
+            cpus = multiprocessing.cpu_count()
+            threads = sorted(set([1, 2, 4, 8, 16, cpus]) & set(range(1, cpus + 1)))
+        names = ['vonmises_stress', 'tresca_stress', 'max_displacement']
+
+        original = (self.get_solver_type(), self.solver_threads)
+        self.set_solver('default', max(threads))
+        self.run_analysis()
+        reference = {name: self.get(name) for name in names}
+
+        best = None
+        for kind in self.get_solver_types():
+            for count in threads:
+                self.set_solver(kind, count)
+                try:
+                    self.run_analysis()
+                except ValueError as err:
+                    if self.debug:
+                        print("Solver", kind, "failed:", err)
+                    break
+                error = max(abs(self.get(name) - reference[name]) / abs(reference[name])
+                            for name in names)
+                seconds = self.timings.get('solve', 0.0) + \
+                    self.timings.get('axisymmetric', 0.0)
+                if self.debug:
+                    print("Solver {} with {} threads: {:.3f} s, relative error {:.2e}".format(
+                        kind, count, seconds, error))
+                if error <= tolerance and (best is None or seconds < best[0]):
+                    best = (seconds, kind, count)
+
+        if best is None:
+            self.set_solver(*original)
+            raise ValueError("No solver setting is within the tolerance")
+        self.set_solver(best[1], best[2])
+        return {'solver_type': best[1], 'solver_threads': best[2]}
+
+    def set_artifact_dir(self, value: str):
+        """
+        Keeps the compressed solver files of all runs in the artifact store
+        of the given directory, or none if the value is empty.
+        """
+        if self.artifact_store is not None:
+            self.artifact_store.close()
+        self.artifact_store = ArtifactStore(value) if value else None
+
+    def get_artifact_dir(self) -> str:
+        return self.artifact_store.directory if self.artifact_store else ''
+
+    def get_design_key(self) -> str:
+        """
+        Returns the key of the current design in the artifact and result
+        stores, which is made of the input parameters and the analysis mode.
+        """
+        params = self.get_inputs()
+        params['analysis_mode'] = self.analysis_mode
+        return resultstore.get_design_key(params)
+
+    def get_inputs(self) -> Dict[str, Any]:
+        """
+        Returns the input parameters of the current design.
+        """
+        return {name: self.get(name) for name in self.get_fieldnames()
+                if name not in resultstore.OUTPUT_FIELDS}
+
+    def archive_files(self, basename: str, prefix: str = ''):
+        """
+        Adds the solver files with the given path without extension to the
+        artifact store, if there is one.
+        """
+        if self.artifact_store is not None:
+            self.artifact_store.add(self.get_design_key(), {
+                prefix + ext: basename + '.' + ext for ext in ['inp', 'frd', 'dat']})
 
     def run_analysis(self):
         """
         Set the various parameters, then call this method and query the results.
         """
-        self.clean()
-        self.doc.recompute()
+        self.timings = dict()
+        self.child_times = dict()
+        self.cache_hits = dict()
+
+        try:
+            start = time.perf_counter()
+            self.clean()
+            self.doc.recompute()
+            self.add_timing('recompute', start)
+
+            if self.analysis_mode != 'axisymmetric':
+                self.run_solid_analysis()
+            if self.analysis_mode != '3d':
+                start = time.perf_counter()
+                if self.axisymmetric_model is None:
+                    self.axisymmetric_model = AxisymmetricModel(self)
+                self.axisymmetric_results = self.axisymmetric_model.run()
+                self.add_timing('axisymmetric', start)
+        finally:
+            if self.profiler is not None:
+                self.profiler.add_run(self.timings, self.child_times)
+        if self.analysis_mode == 'validate' and self.debug:
+            print("Axisymmetric relative error: {:.4f}".format(
+                self.get_axisymmetric_error()))
+
+    def add_timing(self, stage: str, start: float):
+        self.timings[stage] = self.timings.get(stage, 0.0) + \
+            time.perf_counter() - start
+
+    def add_child_time(self, name: str, start: float):
+        self.child_times[name] = self.child_times.get(name, 0.0) + \
+            get_child_time() - start
+
+    def profile(self, filename: str, top: int = 25) -> Profiler:
+        """
+        Returns a context manager that profiles the analyses run inside it
+        and writes the pstats file and a report of the top hotspots, e.g.
+        with vessel.profile('study.pstats'): vessel.evaluate(params).
+        """
+        return Profiler(self, filename, top)
 
-        if self.debug:
-            print("Running GMSH mesher ...", end=' ', flush=True)
-        mesher = GmshTools(self.doc.getObject('FEMMeshGmsh'))
-        err = mesher.create_mesh()
-        if err:
-            raise ValueError(err)
+    def get_mesh_key(self) -> tuple:
+        """
+        Returns the sketch lengths and the mesh length that determine the mesh.
+        """
+        key = [self.sketch_get_length(name) for name in self.sketch_params]
+        key.append(self.get_mesh_length())
+        return tuple(key)
+
+    def run_solid_analysis(self):
+        start = time.perf_counter()
+        mesh_key = self.get_mesh_key()
+        self.cache_hits['mesh'] = mesh_key == self.mesh_key and self.has_mesh_properties()
+        if not self.cache_hits['mesh']:
+            self.mesh_key = None
+            if self.debug:
+                print("Running GMSH mesher ...", end=' ', flush=True)
+            mesher = GmshTools(self.doc.getObject('FEMMeshGmsh'))
+            child_start = get_child_time()
+            err = mesher.create_mesh()
+            self.add_child_time('gmsh', child_start)
+            if err:
+                raise ValueError(err)
+            self.mesh_key = mesh_key
+        elif self.debug:
+            print("Reusing GMSH mesh ...", end=' ', flush=True)
+        self.add_timing('mesh', start)
         obj = self.doc.getObject('FEMMeshGmsh').FemMesh
         if self.debug:
             print(obj.NodeCount, "nodes,",
@@ -270,45 +609,141 @@ class PressureVessel(object):
 
         if self.debug:
             print("Running FEM analysis ...", end=' ', flush=True)
+        start = time.perf_counter()
         fea = FemToolsCcx(
             self.doc.getObject('Analysis'),
             self.doc.getObject('SolverCcxTools'))
         fea.purge_results()
         fea.update_objects()
-        fea.setup_working_dir()
-        fea.setup_ccx()
-        err = fea.check_prerequisites()
-        if err:
-            raise ValueError("FEM error: " + err)
-        fea.write_inp_file()
-        fea.ccx_run()
-        fea.load_results()
-        obj = self.doc.getObject('CCX_Results')
-        assert obj.ResultType == 'Fem::ResultMechanical'
+        working_dir = None if self.scratch is None else self.scratch.acquire()
+        if working_dir is None:
+            fea.setup_working_dir()
+        else:
+            fea.setup_working_dir(working_dir)
+        try:
+            fea.setup_ccx()
+            err = fea.check_prerequisites()
+            if err:
+                raise ValueError("FEM error: " + err)
+            self.write_inp_file(fea)
+            self.add_timing('write_inp', start)
+
+            start = time.perf_counter()
+            if self.solver_threads:
+                self.run_ccx(fea.ccx_binary, fea.working_dir, os.path.splitext(
+                    os.path.basename(fea.inp_file_name))[0])
+            else:
+                child_start = get_child_time()
+                returncode = fea.ccx_run()
+                self.add_child_time('ccx', child_start)
+                if returncode:
+                    # FreeCAD only reports the failure on the console
+                    output = ''
+                    for name in ['ccx_stdout', 'ccx_stderr']:
+                        value = getattr(fea, name, None) or ''
+                        if isinstance(value, bytes):
+                            value = value.decode(errors='replace')
+                        output += value + '\n'
+                    raise ValueError("FEM error: CalculiX exited with code {}: {}".format(
+                        returncode, get_ccx_errors(output)))
+            self.add_timing('solve', start)
+
+            start = time.perf_counter()
+            if self.fast_results:
+                self.solid_results = get_result_summary(
+                    os.path.splitext(fea.inp_file_name)[0] + '.frd')
+            else:
+                fea.load_results()
+                obj = self.doc.getObject('CCX_Results')
+                if obj is None:
+                    raise ValueError("FEM error: no results were loaded")
+                assert obj.ResultType == 'Fem::ResultMechanical'
+            self.archive_files(os.path.splitext(fea.inp_file_name)[0])
+            self.add_timing('results', start)
+        finally:
+            # the results are read, remove the input and result files
+            if working_dir is not None:
+                self.scratch.release(working_dir)
         if self.debug:
-            print("vonMises stress: {:.2f} MPa".format(max(obj.vonMises)))
+            print("vonMises stress: {:.2f} MPa".format(self.get_vonmises_stress()))
+
+    def get_inp_key(self) -> tuple:
+        mesh = self.doc.getObject('FEMMeshGmsh').FemMesh
+        return self.get_mesh_key() + (mesh.NodeCount, mesh.VolumeCount,
+                                      self.get_solver_type())
+
+    def write_inp_file(self, fea: FemToolsCcx):
+        """
+        Writes the CalculiX input file. If only the material or the pressure
+        changed since the last run, then the previous input deck is patched
+        instead of running the FreeCAD writer. The first patched deck is
+        compared against the FreeCAD writer and patching is turned off if
+        they differ.
+        """
+        key = self.get_inp_key()
+        self.cache_hits['inp'] = self.patch_inp and self.inp_template is not None \
+            and self.inp_template.key == key
+        if not self.cache_hits['inp']:
+            fea.write_inp_file()
+            if self.patch_inp:
+                with open(fea.inp_file_name) as file:
+                    self.inp_template = InpTemplate(
+                        key, file.read(), os.path.basename(fea.inp_file_name))
+            return
+
+        text = self.inp_template.patch(
+            self.get_youngs_modulus(), self.get_poisson_ratio(),
+            self.get_density(), self.get_pressure())
+
+        if not self.inp_verified:
+            fea.write_inp_file()
+            with open(fea.inp_file_name) as file:
+                if not self.inp_template.matches(file.read(), text):
+                    print("WARNING: patched input file differs from the FreeCAD writer")
+                    self.patch_inp = False
+                    self.inp_template = None
+                    return
+            self.inp_verified = True
+
+        fea.inp_file_name = os.path.join(fea.working_dir, self.inp_template.basename)
+        with open(fea.inp_file_name, 'w') as file:
+            file.write(text)
 
     def has_mesh_properties(self):
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results is not None
         obj = self.doc.getObject('FEMMeshGmsh').FemMesh
         return True if obj and obj.NodeCount else False
 
     def get_node_count(self):
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results['node_count']
         obj = self.doc.getObject('FEMMeshGmsh').FemMesh
         return obj.NodeCount
 
     def get_edge_count(self):
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results['edge_count']
         obj = self.doc.getObject('FEMMeshGmsh').FemMesh
         return obj.EdgeCount
 
     def get_face_count(self):
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results['face_count']
         obj = self.doc.getObject('FEMMeshGmsh').FemMesh
         return obj.FaceCount
 
     def get_volume_count(self):
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results['volume_count']
         obj = self.doc.getObject('FEMMeshGmsh').FemMesh
         return obj.VolumeCount
 
     def has_fem_properties(self):
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results is not None
+        if self.solid_results is not None:
+            return True
         obj = self.doc.getObject('CCX_Results')
         return True if obj else False
 
@@ -316,6 +751,10 @@ class PressureVessel(object):
         """
         Returns the maximum vonMises stress in mega pascals.
         """
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results['vonmises_stress']
+        if self.solid_results is not None:
+            return self.solid_results['vonmises_stress']
         obj = self.doc.getObject('CCX_Results')
         return max(obj.vonMises)
 
@@ -323,6 +762,10 @@ class PressureVessel(object):
         """
         Returns the maximum tresca (shear) stress in mega pascals.
         """
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results['tresca_stress']
+        if self.solid_results is not None:
+            return self.solid_results['tresca_stress']
         obj = self.doc.getObject('CCX_Results')
         return max(obj.MaxShear)
 
@@ -330,6 +773,10 @@ class PressureVessel(object):
         """
         Returns the maximum displacement in meters.
         """
+        if self.analysis_mode == 'axisymmetric':
+            return self.axisymmetric_results['max_displacement']
+        if self.solid_results is not None:
+            return self.solid_results['max_displacement']
         obj = self.doc.getObject('CCX_Results')
         return max(obj.DisplacementLengths) * 1e-3
 
@@ -339,6 +786,17 @@ class PressureVessel(object):
         """
         return self.get_vonmises_stress() >= self.get_tensile_strength()
 
+    def get_axisymmetric_error(self) -> float:
+        """
+        Returns the largest relative difference between the outputs of the
+        axisymmetric and the 3D analysis in validate mode.
+        """
+        error = 0.0
+        for name in ['vonmises_stress', 'tresca_stress', 'max_displacement']:
+            value = self.get(name)
+            error = max(error, abs(self.axisymmetric_results[name] - value) / abs(value))
+        return error
+
     def set(self, name: str, value: Any):
         """
         Allows to set any parameter value of the model. Do not name methods starting
@@ -363,12 +821,20 @@ class PressureVessel(object):
         else:
             raise ValueError("Unknown parameter: " + name)
 
-    def csv_open_output(self, filename: str) -> csv.DictWriter:
-        if filename == '-':
-            file = sys.stdout
-        else:
-            file = open(filename, 'w', newline='', encoding='utf-8')
+    def set_relative_mesh_length(self, value: float):
+        """
+        Sets the mesh length relative to the cube root of the body volume.
+        The model is recomputed first so the volume of the current design
+        is used.
+        """
+        self.recompute()
+        self.set_mesh_length(value * (self.get_body_volume() ** 0.333))
 
+    def get_fieldnames(self) -> List[str]:
+        """
+        Returns the names of all parameters and analysis outputs in the order
+        they are written to the output files.
+        """
         fieldnames = list(self.sketch_params)
         fieldnames.extend([
             'pressure', 'mesh_length',
@@ -377,41 +843,186 @@ class PressureVessel(object):
             'node_count', 'edge_count', 'face_count', 'volume_count',
             'vonmises_stress', 'tresca_stress', 'max_displacement', 'has_failed'
         ])
+        if self.analysis_mode == 'validate':
+            fieldnames.append('axisymmetric_error')
+        return fieldnames
+
+    def get_row(self, fieldnames: List[str]) -> Dict[str, Any]:
+        return {name: self.get(name) for name in fieldnames}
+
+    def evaluate(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Sets the given parameters in order, runs the analysis and returns
+        all parameters and outputs of the design.
+        """
+        for name, value in params.items():
+            self.set(name, value)
+        self.run_analysis()
+        return self.get_row(self.get_fieldnames())
+
+    def estimate_size(self, params: Dict[str, Any]) -> float:
+        """
+        Sets the given parameters and returns the body volume divided by the
+        cube of the mesh length, which is proportional to the number of nodes
+        of the mesh. This only recomputes the geometry, so it is cheap.
+        """
+        for name, value in params.items():
+            self.set(name, value)
+        self.recompute()
+        return self.get_body_volume() / self.get_mesh_length() ** 3
+
+    def evaluate_converged(self, params: Dict[str, Any], mesh_options: List[float],
+                           window: int = 6, threshold: float = 0.05,
+                           start: int = 0) -> Dict[str, Any]:
+        """
+        Sets the given parameters, then runs the analysis with the mesh lengths
+        of mesh_options starting at the given index, until the coefficient of
+        variation of the last window von Mises stresses drops below the
+        threshold. Mesh lengths where the analysis fails are skipped. Returns
+        the row of the last successful analysis with the converged flag and
+        the number of analyses.
+        """
+        for name, value in params.items():
+            self.set(name, value)
+
+        stresses = []
+        row = None
+        converged = False
+        iterations = 0
+        for mesh_length in mesh_options[start:]:
+            self.set_mesh_length(mesh_length)
+            iterations += 1
+            try:
+                self.run_analysis()
+            except ValueError as err:
+                if self.debug:
+                    print("Skipping mesh length", mesh_length, err)
+                continue
 
-        writer = csv.DictWriter(file, fieldnames)
-        if filename != '-':
-            writer.file = file
-        writer.writeheader()
-        return writer
+            row = self.get_row(self.get_fieldnames())
+            stresses.append(row['vonmises_stress'])
+            if len(stresses) > window:
+                last = stresses[-window:]
+                if statistics.stdev(last) <= threshold * statistics.mean(last):
+                    converged = True
+                    break
+
+        if row is None:
+            raise ValueError("Analysis failed for all mesh lengths")
+        row['converged'] = converged
+        row['mesh_iterations'] = iterations
+        return row
+
+    def sensitivities(self, params: Dict[str, Any], step: float = 1e-3,
+                      names: Optional[List[str]] = None,
+                      outputs: Optional[List[str]] = None,
+                      jobs: Optional[int] = None) -> Jacobian:
+        """
+        Sets the given parameters and returns the central finite difference
+        derivatives of the outputs with respect to the given input names (by
+        default the parameters in params except the mesh lengths, a relative
+        mesh length stands for the mesh length), using steps relative to
+        their values. The perturbed
+        designs of the sketch and mesh lengths need a new mesh, so they are
+        evaluated concurrently in at most jobs (by default the number of
+        cores) worker processes. The other perturbations keep the geometry,
+        so they are evaluated in this process meanwhile, reusing the base mesh
+        and patching its input deck. The cores are shared evenly between the
+        solvers of the workers and this process. The vessel is left at the
+        base design.
+        """
+        for name, value in params.items():
+            self.set(name, value)
+        if names is None:
+            # derivatives by the mesh length are discretization errors
+            names = [name for name in params if name not in study.MESH_PARAMS]
+        names = list(dict.fromkeys(
+            'mesh_length' if name == 'relative_mesh_length' else name
+            for name in names))
+        base = self.get_inputs()
+        unknown = [name for name in names if name not in base]
+        if unknown:
+            raise ValueError("Unknown input parameters: " + ', '.join(unknown))
+        jacobian = Jacobian(base, names, outputs or DEFAULT_OUTPUTS,
+                            get_steps(base, names, step))
+
+        jobs = jobs or os.cpu_count() or 1
+        threads = max(1, (os.cpu_count() or 1) // (jobs + 1))
+        if self.solver_threads:
+            threads = min(threads, self.solver_threads)
+
+        remeshed = [name for name in names
+                    if name in self.sketch_params or name == 'mesh_length']
+        designs = []
+        for name in remeshed:
+            designs.extend(get_perturbed_designs(base, name, jacobian.steps[name]))
+        futures = []
+        if designs:
+            futures = self.get_sensitivity_pool(jobs, threads).submit(designs)
+
+        rows = dict()
+        solver_threads = self.solver_threads
+        self.solver_threads = threads
+        try:
+            for name in names:
+                if name in remeshed:
+                    continue
+                rows[name] = []
+                for design in get_perturbed_designs(base, name, jacobian.steps[name]):
+                    try:
+                        rows[name].append(self.evaluate(design))
+                    except ValueError as err:
+                        rows[name].append(None)
+                        jacobian.errors[name] = str(err)
+            jacobian.base = self.evaluate(base)
+        finally:
+            self.solver_threads = solver_threads
+
+        for index, name in enumerate(remeshed):
+            rows[name] = []
+            for future in futures[2 * index:2 * index + 2]:
+                try:
+                    rows[name].append(future.result())
+                except WorkerError as err:
+                    rows[name].append(None)
+                    jacobian.errors[name] = str(err)
+        for name in names:
+            jacobian.add(name, *rows[name])
+        return jacobian
+
+    def get_sensitivity_pool(self, jobs: int, threads: int) -> SensitivityPool:
+        """
+        Returns the pool of jobs worker processes of the sensitivities, each
+        running the solver with the given number of threads and the current
+        solver settings. The pool is kept between the calls.
+        """
+        defaults = {name: self.get(name) for name in [
+            'analysis_mode', 'solver_type', 'scratch_dir']}
+        defaults['solver_threads'] = threads
+        pool = self.sensitivity_pool
+        if pool is None or pool.defaults != defaults or pool.jobs != jobs:
+            if pool is not None:
+                pool.close()
+            self.sensitivity_pool = SensitivityPool(self.filename, defaults=defaults,
+                                                    jobs=jobs)
+        return self.sensitivity_pool
+
+    def csv_open_output(self, filename: str) -> csv.DictWriter:
+        return study.csv_open_output(filename, self.get_fieldnames())
 
     def csv_write_row(self, writer: csv.DictWriter):
-        row = {name: self.get(name) for name in writer.fieldnames}
-        writer.writerow(row)
+        writer.writerow(self.get_row(writer.fieldnames))
 
     def csv_close_output(self, writer: csv.DictWriter):
-        if hasattr(writer, 'file'):
-            writer.file.close()
+        study.csv_close_output(writer)
 
-    def study_random(self, count: int, output: str):
+    def study_random(self, count: int, output: str, seed: Optional[str] = None,
+                     shard: Tuple[int, int] = (0, 1)):
         writer = self.csv_open_output(output)
-        for _ in range(count):
-            # set sketch lengths
-            for name in self.sketch_params:
-                if 'thickness' in name:
-                    value = random.uniform(0.001, 0.01)
-                elif 'length' in name:
-                    value = random.uniform(0.0, 2.0)
-                elif 'radius' in name:
-                    value = random.uniform(0.1, 1.0)
-                else:
-                    value = random.uniform(0.0, 1.0)
+        for _, params in study.random_designs(self.sketch_params, count, seed, shard):
+            for name, value in params.items():
                 print("setting", name, "=", value)
-                self.sketch_set_length(name, value)
-
-            self.recompute()
-            mesh_len = 0.04 * (self.get_body_volume() ** 0.333)
-            print("setting mesh_len =", mesh_len)
-            self.set_mesh_length(mesh_len)
+                self.set(name, value)
             self.run_analysis()
             self.csv_write_row(writer)
         self.csv_close_output(writer)
@@ -422,21 +1033,252 @@ def run(args=None):
 
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('model', type=str, metavar='FILE',
+    parser.add_argument('model', type=str, metavar='FILE', nargs='?',
                         help="a parametric FreeCAD model of the pressure vessel model")
-    parser.add_argument('--study', type=str, choices=['random'], default=None,
+    parser.add_argument('--study', type=str, choices=['random', 'file'], default=None,
                         help="generate a CSV file for the given study")
+    parser.add_argument('--design', type=str, metavar='FILE', default=None,
+                        help="CSV file of design points for the file study")
+    parser.add_argument('--group', action='store_true',
+                        help="run designs with the same geometry and material consecutively")
+    parser.add_argument('--check', action='store_true',
+                        help="reject designs that violate the sketch constraints before running")
     parser.add_argument('--output', type=str, metavar='FILE', default='output.csv',
                         help="output CSV filename")
     parser.add_argument('--count', type=int, metavar='NUM', default=1000,
                         help="generate this many random samples")
+    parser.add_argument('--seed', type=str, default=None,
+                        help="seed of the random study, makes the designs reproducible")
+    parser.add_argument('--shard', type=str, metavar='I/N', default=None,
+                        help="run only the designs whose index is I modulo N")
+    parser.add_argument('--merge', type=str, metavar='FILE', nargs='+', default=None,
+                        help="merge the output files of shards into the output file")
+    parser.add_argument('--analysis', type=str, choices=['3d', 'axisymmetric', 'validate'],
+                        default='3d', help="the analysis mode of the simulations")
+    parser.add_argument('--solver', type=str, default=None,
+                        help="the matrix solver of CalculiX supported by the template, "
+                        "e.g. default, spooles, pardiso or iterativecholesky")
+    parser.add_argument('--threads', type=int, metavar='NUM', default=None,
+                        help="number of CalculiX threads (0 lets FreeCAD decide)")
+    parser.add_argument('--autotune', action='store_true',
+                        help="benchmark the solvers on the template and use the fastest one")
+    parser.add_argument('--autotune-tolerance', type=float, metavar='NUM', default=1e-3,
+                        help="allowed relative difference from the default solver")
+    parser.add_argument('--max-memory', type=float, metavar='MB', default=None,
+                        help="restart the worker process above this memory usage")
+    parser.add_argument('--max-runs', type=int, metavar='NUM', default=None,
+                        help="restart the worker process after this many analyses")
+    parser.add_argument('--queue', type=str, metavar='FILE', default=None,
+                        help="submit the study to this shared job queue instead of running it")
+    parser.add_argument('--worker', action='store_true',
+                        help="run the jobs of the queue")
+    parser.add_argument('--collect', action='store_true',
+                        help="write the results of the queue to the output CSV file")
+    parser.add_argument('--lease', type=float, metavar='SEC', default=600.0,
+                        help="jobs of workers not seen for this long are requeued")
+    parser.add_argument('--wait', type=float, metavar='SEC', default=0.0,
+                        help="time a worker waits for new jobs in an empty queue")
+    parser.add_argument('--batch', type=str, metavar='FILE[=DESIGNS]', action='append',
+                        help="add a template with its own design CSV file (or random designs)"
+                        " to a batch study, can be repeated")
+    parser.add_argument('--jobs', type=int, metavar='NUM', default=None,
+                        help="number of worker processes of a batch study (default: all cores)")
+    parser.add_argument('--cores', type=int, metavar='NUM', default=None,
+                        help="choose the solver threads of each design of a study, worker or "
+                        "batch study by its predicted mesh size, using at most this many cores")
+    parser.add_argument('--nodes-per-thread', type=int, metavar='NUM', default=50000,
+                        help="predicted mesh nodes per solver thread for --cores")
+    parser.add_argument('--metrics', type=str, metavar='FILE', default=None,
+                        help="periodically write the progress of the study to this "
+                        "JSON file (or Prometheus text file if it ends with .prom)")
+    parser.add_argument('--metrics-interval', type=float, metavar='SEC', default=30.0,
+                        help="time between the updates of the metrics file")
+    parser.add_argument('--store', type=str, metavar='FILE', default=None,
+                        help="skip designs already in this SQLite result store and add the new results")
+    parser.add_argument('--profile', type=str, metavar='FILE', default=None,
+                        help="profile the analyses in this process and write the pstats file "
+                        "and a report of the hotspots")
+    parser.add_argument('--profile-runs', type=int, metavar='NUM', default=10,
+                        help="number of study designs to profile")
+    parser.add_argument('--artifacts', type=str, metavar='DIR', default=None,
+                        help="keep the compressed solver files of every run in this directory")
+    parser.add_argument('--scratch', type=str, metavar='DIR', default='',
+                        help="directory of the solver working directories (default: /dev/shm "
+                        "if available, 'freecad' for the FreeCAD working directory)")
+    parser.add_argument('--converge', action='store_true',
+                        help="refine the mesh of each design until its stress converges")
+    parser.add_argument('--mesh-min', type=float, metavar='M', default=0.03,
+                        help="the finest mesh length of the convergence sweep")
+    parser.add_argument('--mesh-max', type=float, metavar='M', default=0.1,
+                        help="the coarsest mesh length of the convergence sweep")
+    parser.add_argument('--mesh-step', type=float, metavar='M', default=0.002,
+                        help="the mesh length step of the convergence sweep")
+    parser.add_argument('--window', type=int, metavar='NUM', default=6,
+                        help="number of last analyses checked for convergence")
+    parser.add_argument('--threshold', type=float, metavar='NUM', default=0.05,
+                        help="relative standard deviation of converged stresses")
+    parser.add_argument('--mesh-index', type=str, metavar='FILE', default=None,
+                        help="CSV file of converged mesh lengths to start the sweeps from")
     args = parser.parse_args(args)
 
-    vessel = PressureVessel(args.model)
-
-    if args.study == 'random':
-        vessel.study_random(args.count, args.output)
+    if args.study == 'file' and args.design is None:
+        parser.error("the file study requires a --design file")
+    shard = (0, 1)
+    if args.shard:
+        try:
+            shard = study.parse_shard(args.shard)
+        except ValueError as err:
+            parser.error(str(err))
+        random_batch = any('=' not in spec for spec in args.batch or [])
+        if (args.study == 'random' or random_batch) and args.seed is None:
+            parser.error("a sharded random study requires a --seed")
+    if args.batch and (args.queue or args.converge):
+        parser.error("batch studies cannot be combined with --queue or --converge")
+    if args.store and (args.queue or args.batch):
+        parser.error("the result store is only supported for local studies")
+    if args.converge and args.queue:
+        parser.error("convergence sweeps are not supported with a --queue")
+    if args.cores and (args.profile or args.merge or not (
+            args.batch or args.worker or (args.study and not args.queue))):
+        parser.error("--cores requires --batch, --worker or a local --study")
+    if args.queue and args.study and args.model is None:
+        parser.error("submitting a study to the queue requires the model argument")
+
+    def get_designs(sketch_params):
+        if args.study == 'random':
+            return study.random_designs(sketch_params, args.count, args.seed, shard)
+        else:
+            return study.shard_items(study.read_indexed_designs(args.design), shard)
+
+    defaults = {'analysis_mode': args.analysis}
+    if args.scratch:
+        defaults['scratch_dir'] = args.scratch
+    if args.solver:
+        defaults['solver_type'] = args.solver
+    if args.threads is not None:
+        defaults['solver_threads'] = args.threads
+    if args.artifacts:
+        defaults['artifact_dir'] = os.path.abspath(args.artifacts)
+    study_metrics = None
+    if args.metrics:
+        study_metrics = metrics.StudyMetrics(args.metrics,
+                                             interval=args.metrics_interval)
+    max_memory = None if args.max_memory is None else int(
+        args.max_memory * 1048576)
+    core_scheduler = None
+    if args.cores:
+        core_scheduler = scheduler.CoreScheduler(
+            args.cores, nodes_per_thread=args.nodes_per_thread)
+
+    if args.solver:
+        # the supported solvers depend on the FreeCAD version of the template
+        templates = [spec.partition('=')[0] for spec in args.batch or []]
+        if args.model is not None:
+            templates.append(args.model)
+        for template in templates:
+            try:
+                with VesselWorker(template) as worker:
+                    solver_types = worker.call('get_solver_types')
+            except WorkerError as err:
+                parser.error(str(err))
+            if args.solver not in solver_types:
+                parser.error("unknown solver {} for {}, choose from {}".format(
+                    args.solver, template, ', '.join(solver_types)))
+
+    if args.autotune:
+        if args.model is None or args.batch:
+            parser.error("autotuning requires a single model")
+        try:
+            with VesselWorker(args.model, defaults=defaults) as worker:
+                defaults.update(worker.call('autotune_solver', args.autotune_tolerance))
+        except WorkerError as err:
+            parser.error("autotuning failed: " + str(err))
+        print("Selected solver {} with {} threads".format(
+            defaults['solver_type'], defaults['solver_threads']))
+
+    if args.merge:
+        print("Merged", study.merge_outputs(args.merge, args.output), "rows")
+    elif args.queue:
+        queue = jobqueue.JobQueue(args.queue, lease_time=args.lease)
+        if args.study:
+            runner = study.StudyRunner(args.model, defaults=defaults)
+            designs = get_designs(runner.sketch_params)
+            if args.group:
+                designs = study.group_items(designs, runner.sketch_params)
+            rejected = []
+            if args.check:
+                designs, rejected = runner.get_feasible(designs)
+                rejected = [(index, params, 'Infeasible: ' + reason)
+                            for index, params, reason in rejected]
+                print("Rejected", len(rejected), "infeasible designs")
+            count = queue.submit(args.model, runner.worker.fieldnames, designs,
+                                 defaults=defaults, rejected=rejected)
+            runner.worker.stop()
+            print("Submitted", count, "jobs")
+        elif args.worker:
+            worker = jobqueue.QueueWorker(queue, max_memory=max_memory,
+                                          max_runs=args.max_runs,
+                                          wait=args.wait, metrics=study_metrics,
+                                          scheduler=core_scheduler, debug=True)
+            print("Finished", worker.run(), "jobs")
+        if args.collect:
+            queue.export(args.output)
+        else:
+            print("Queue status:", ", ".join(
+                "{} {}".format(count, state)
+                for state, count in queue.get_counts().items()))
+        queue.close()
+    elif args.batch:
+        runner = batch.BatchRunner(jobs=args.jobs, defaults=defaults,
+                                   max_memory=max_memory, max_runs=args.max_runs,
+                                   metrics=study_metrics, shard=shard,
+                                   scheduler=core_scheduler, debug=True)
+        for spec in args.batch:
+            template, _, design = spec.partition('=')
+            if design:
+                runner.add(template, list(study.read_indexed_designs(design)), indexed=True)
+            else:
+                runner.add(template, lambda sketch_params: [
+                    params for _, params in study.random_designs(
+                        sketch_params, args.count, args.seed)])
+        runner.run(args.output, group=args.group, check=args.check)
+    elif args.model is None:
+        parser.error("the model argument is required")
+    elif args.profile:
+        vessel = PressureVessel(args.model, debug=False)
+        for name, value in defaults.items():
+            vessel.set(name, value)
+        with vessel.profile(args.profile) as profiler:
+            if args.study:
+                designs = get_designs(vessel.sketch_params)
+                for _, (_, params) in zip(range(args.profile_runs), designs):
+                    try:
+                        vessel.evaluate(params)
+                    except ValueError as err:
+                        print("Analysis failed:", err)
+            else:
+                vessel.run_analysis()
+        print(profiler.get_report())
+    elif args.study:
+        store = None if args.store is None else resultstore.ResultStore(args.store)
+        runner = study.StudyRunner(args.model, defaults=defaults,
+                                   max_memory=max_memory, max_runs=args.max_runs,
+                                   metrics=study_metrics, store=store,
+                                   scheduler=core_scheduler, debug=True)
+        if args.converge:
+            runner.convergence = convergence.MeshConvergence(
+                convergence.get_mesh_options(
+                    args.mesh_min, args.mesh_max, args.mesh_step),
+                window=args.window, threshold=args.threshold,
+                index=convergence.MeshIndex(runner.sketch_params, args.mesh_index))
+        runner.run(get_designs(runner.sketch_params), args.output,
+                   group=args.group, check=args.check, indexed=True)
+        if store is not None:
+            store.close()
     else:
+        vessel = PressureVessel(args.model)
+        for name, value in defaults.items():
+            vessel.set(name, value)
         vessel.run_analysis()
         vessel.print_info()
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict
+import collections
+import cProfile
+import io
+import os
+import pstats
+import resource
+import time
+
+
+def get_child_time() -> float:
+    """
+    Returns the CPU time used by the finished child processes (gmsh and
+    ccx) of the current process in seconds.
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Profiler(object):
+    """
+    Profiles the analyses of a pressure vessel run inside its context with
+    cProfile. On exit the statistics are written to the given pstats file
+    and a short report to the same name with a .txt extension. The report
+    lists the wall time of the analysis stages and the CPU time of the gmsh
+    and ccx child processes separately, since cProfile only sees the Python
+    side waiting for them, followed by the top Python hotspots.
+    """
+
+    def __init__(self, vessel, filename: str, top: int = 25):
+        self.vessel = vessel
+        self.filename = filename
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.runs = 0
+        self.stage_times: Dict[str, float] = collections.Counter()
+        self.child_times: Dict[str, float] = collections.Counter()
+        self.start_time = 0.0
+        self.wall_time = 0.0
+
+    def add_run(self, timings: Dict[str, float], child_times: Dict[str, float]):
+        self.runs += 1
+        self.stage_times.update(timings)
+        self.child_times.update(child_times)
+
+    def __enter__(self):
+        self.vessel.profiler = self
+        self.start_time = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        self.wall_time = time.perf_counter() - self.start_time
+        self.vessel.profiler = None
+        self.profile.dump_stats(self.filename)
+        with open(os.path.splitext(self.filename)[0] + '.txt', 'w') as file:
+            file.write(self.get_report())
+
+    def get_report(self) -> str:
+        out = io.StringIO()
+        out.write("Profiled {} analyses in {:.2f} s wall time\n\n".format(
+            self.runs, self.wall_time))
+
+        out.write("Analysis stages (wall time):\n")
+        for stage, value in sorted(self.stage_times.items(), key=lambda x: -x[1]):
+            out.write("  {:<14} {:10.3f} s {:10.3f} s/run\n".format(
+                stage, value, value / max(1, self.runs)))
+
+        out.write("\nChild processes (CPU time):\n")
+        for name, value in sorted(self.child_times.items(), key=lambda x: -x[1]):
+            out.write("  {:<14} {:10.3f} s {:10.3f} s/run\n".format(
+                name, value, value / max(1, self.runs)))
+
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.strip_dirs()
+        out.write("\nTop Python functions by cumulative time:\n")
+        stats.sort_stats('cumulative').print_stats(self.top)
+        out.write("Top Python functions by own time:\n")
+        stats.sort_stats('tottime').print_stats(self.top)
+        return out.getvalue()
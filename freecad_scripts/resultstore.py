@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+import numpy
+
+from freecad_scripts.csvfiles import csv_open_output, csv_close_output
+
+
+# the analysis outputs and bookkeeping columns, everything else is an input
+OUTPUT_FIELDS = [
+    'body_area', 'body_volume', 'body_mass', 'outer_area', 'outer_volume',
+    'inner_area', 'inner_volume', 'node_count', 'edge_count', 'face_count',
+    'volume_count', 'vonmises_stress', 'tresca_stress', 'max_displacement',
+    'has_failed', 'axisymmetric_error', 'converged', 'mesh_iterations',
+    'index', 'error', 'template',
+]
+
+# parameters that do not change the results of a design
+SETTING_FIELDS = ['artifact_dir', 'scratch_dir', 'solver_threads']
+
+# outputs stored as 0 or 1 that are returned as booleans
+BOOL_FIELDS = ['has_failed', 'converged']
+
+# the columns of the results table that are not analysis fields
+STORE_FIELDS = ['id', 'template_hash', 'design_key', 'request_key']
+
+
+def get_template_hash(filename: str) -> str:
+    """
+    Returns a short hash of the content of the template file, so results of
+    a modified template are not mixed up with the old ones.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def get_design_key(params: Dict[str, Any]) -> str:
+    """
+    Returns a canonical string of the input parameters of a design. Numbers
+    are rounded to 12 significant digits so that values read back from CSV
+    files match the original ones.
+    """
+    values = dict()
+    for name, value in params.items():
+        if name in OUTPUT_FIELDS or name in SETTING_FIELDS:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float('{:.12g}'.format(value))
+        values[name] = value
+    return json.dumps(values, sort_keys=True)
+
+
+def quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class ResultStore(object):
+    """
+    An SQLite database of analysis results of several templates. Every
+    field of the output rows is a column of the results table with its own
+    index, so range queries over parameters and outputs do not scan the whole
+    table. Rows are identified by the template hash and their input columns,
+    and inserting an already stored design is ignored.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, timeout=600.0)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_hash TEXT NOT NULL,
+            design_key TEXT NOT NULL,
+            request_key TEXT NOT NULL,
+            UNIQUE (template_hash, design_key))""")
+        self.conn.execute("""CREATE INDEX IF NOT EXISTS results_request
+            ON results (template_hash, request_key)""")
+        self.conn.commit()
+        self.columns = self.get_columns()
+
+    def close(self):
+        self.conn.close()
+
+    def get_columns(self) -> List[str]:
+        return [row[1] for row in self.conn.execute('PRAGMA table_info(results)')]
+
+    def add_columns(self, names: Iterable[str]):
+        for name in names:
+            if name in self.columns:
+                continue
+            self.conn.execute('ALTER TABLE results ADD COLUMN {}'.format(quote(name)))
+            self.conn.execute('CREATE INDEX IF NOT EXISTS {} ON results ({})'.format(
+                quote('results_' + name), quote(name)))
+            self.columns.append(name)
+
+    def insert(self, template_hash: str, row: Dict[str, Any],
+               request: Optional[Dict[str, Any]] = None, commit=True) -> bool:
+        """
+        Stores an output row of the given template. The request is the design
+        as it was submitted (e.g. with a relative mesh length), it defaults to
+        the row. Returns False if the design is already in the store. The
+        index of the design in its study is not stored.
+        """
+        row = {name: value for name, value in row.items()
+               if name not in STORE_FIELDS and name != 'index' and value != ''}
+        self.add_columns(row)
+        names = ['template_hash', 'design_key', 'request_key'] + list(row)
+        values = [template_hash, get_design_key(row),
+                  get_design_key(row if request is None else request)]
+        values.extend(row.values())
+        cursor = self.conn.execute(
+            'INSERT OR IGNORE INTO results ({}) VALUES ({})'.format(
+                ', '.join(map(quote, names)), ', '.join('?' * len(names))),
+            values)
+        if commit:
+            self.conn.commit()
+        return cursor.rowcount > 0
+
+    def insert_many(self, template_hash: str,
+                    rows: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Stores many output rows in one transaction and returns the number
+        of inserted and duplicate rows.
+        """
+        inserted = duplicates = 0
+        try:
+            for row in rows:
+                if self.insert(template_hash, row, commit=False):
+                    inserted += 1
+                else:
+                    duplicates += 1
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            self.columns = self.get_columns()
+            raise
+        return inserted, duplicates
+
+    def import_csv(self, template_hash: str, filename: str) -> Tuple[int, int]:
+        """
+        Stores the rows of a study output file, see insert_many. Failed
+        designs are skipped.
+        """
+        with open(filename, newline='', encoding='utf-8') as file:
+            rows = []
+            for row in csv.DictReader(file):
+                if row.get('error'):
+                    continue
+                for name, value in row.items():
+                    try:
+                        row[name] = float(value)
+                    except ValueError:
+                        if value in ('True', 'False'):
+                            row[name] = value == 'True'
+                rows.append(row)
+        return self.insert_many(template_hash, rows)
+
+    def lookup(self, template_hash: str,
+               request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Returns the stored row of the given design, or None if it has not
+        been simulated yet. The design is matched both as submitted and by
+        its input columns.
+        """
+        key = get_design_key(request)
+        cursor = self.conn.execute(
+            """SELECT * FROM results WHERE template_hash = ?
+            AND (request_key = ? OR design_key = ?) LIMIT 1""",
+            (template_hash, key, key))
+        rows = self.get_rows(cursor)
+        return rows[0] if rows else None
+
+    @staticmethod
+    def get_rows(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+        names = [desc[0] for desc in cursor.description]
+        rows = []
+        for values in cursor:
+            row = {name: value for name, value in zip(names, values)
+                   if value is not None and name not in STORE_FIELDS}
+            for name in BOOL_FIELDS:
+                if name in row:
+                    row[name] = bool(row[name])
+            rows.append(row)
+        return rows
+
+    def query(self, where: Iterable[Tuple[str, str, Any]] = (),
+              template_hash: Optional[str] = None,
+              order_by: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the rows that satisfy all conditions, which are given as
+        (name, operator, value) triples such as ('body_mass', '<', 50.0).
+        """
+        conditions = []
+        values = []
+        if template_hash is not None:
+            conditions.append('template_hash = ?')
+            values.append(template_hash)
+        for name, op, value in where:
+            if name not in self.columns:
+                raise ValueError("Unknown column: " + name)
+            if op not in ('<', '<=', '=', '>=', '>', '!='):
+                raise ValueError("Unknown operator: " + op)
+            conditions.append('{} {} ?'.format(quote(name), op))
+            values.append(value)
+
+        sql = 'SELECT * FROM results'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if order_by is not None:
+            if order_by not in self.columns:
+                raise ValueError("Unknown column: " + order_by)
+            sql += ' ORDER BY ' + quote(order_by)
+        else:
+            sql += ' ORDER BY id'
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        return self.get_rows(self.conn.execute(sql, values))
+
+    def get_fieldnames(self, rows: List[Dict[str, Any]]) -> List[str]:
+        present = set(name for row in rows for name in row)
+        return [name for name in self.columns if name in present]
+
+    def export_csv(self, rows: List[Dict[str, Any]], output: str):
+        writer = csv_open_output(output, self.get_fieldnames(rows))
+        for row in rows:
+            writer.writerow(row)
+        csv_close_output(writer)
+
+    def to_numpy(self, rows: List[Dict[str, Any]]) -> numpy.ndarray:
+        """
+        Returns the numeric columns of the rows as a structured array, where
+        missing values are NaN.
+        """
+        names = [name for name in self.get_fieldnames(rows)
+                 if all(isinstance(row.get(name, 0.0), (int, float)) for row in rows)]
+        array = numpy.full(len(rows), numpy.nan, dtype=[(name, float) for name in names])
+        for index, row in enumerate(rows):
+            for name in names:
+                if name in row:
+                    array[index][name] = row[name]
+        return array
+
+    def get_counts(self) -> Dict[str, int]:
+        return dict(self.conn.execute(
+            'SELECT template_hash, COUNT(*) FROM results GROUP BY template_hash'))
+
+
+def parse_condition(text: str) -> Tuple[str, str, Any]:
+    """
+    Parses a condition such as body_mass<50 or has_failed=0.
+    """
+    match = re.match(r'^\s*(\w+)\s*(<=|>=|!=|==|=|<|>)\s*(.+?)\s*$', text)
+    if match is None:
+        raise ValueError("Invalid condition: " + text)
+    name, op, value = match.groups()
+    if op == '==':
+        op = '='
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+    return name, op, value
+
+
+def run(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('store', type=str, metavar='FILE',
+                        help="the SQLite result store")
+    parser.add_argument('--import', type=str, metavar='CSV', dest='imports',
+                        action='append', default=[],
+                        help="add the rows of a study output file, can be repeated")
+    parser.add_argument('--template', type=str, metavar='FILE', default=None,
+                        help="the template of the imported or queried results")
+    parser.add_argument('--where', type=str, metavar='COND', action='append', default=[],
+                        help="select rows by a condition such as 'body_mass<50', can be repeated")
+    parser.add_argument('--order-by', type=str, metavar='NAME', default=None,
+                        help="sort the selected rows by this column")
+    parser.add_argument('--limit', type=int, metavar='NUM', default=None,
+                        help="select at most this many rows")
+    parser.add_argument('--output', type=str, metavar='FILE', default=None,
+                        help="write the selected rows to this CSV file (or .npy file)")
+    args = parser.parse_args(args)
+
+    store = ResultStore(args.store)
+    template_hash = None
+    if args.template:
+        template_hash = get_template_hash(args.template)
+
+    if args.imports:
+        if template_hash is None:
+            parser.error("importing requires the --template of the results")
+        for filename in args.imports:
+            inserted, duplicates = store.import_csv(template_hash, filename)
+            print("Imported {} rows from {}, skipped {} duplicates".format(
+                inserted, filename, duplicates))
+
+    if args.output or args.where:
+        try:
+            rows = store.query([parse_condition(cond) for cond in args.where],
+                               template_hash=template_hash,
+                               order_by=args.order_by, limit=args.limit)
+        except ValueError as err:
+            parser.error(str(err))
+        if args.output and os.path.splitext(args.output)[1] == '.npy':
+            numpy.save(args.output, store.to_numpy(rows))
+        else:
+            store.export_csv(rows, args.output or '-')
+        if args.output:
+            print("Selected", len(rows), "rows")
+    elif not args.imports:
+        for key, count in store.get_counts().items():
+            print("Template {}: {} rows".format(key, count))
+    store.close()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Deque, Dict, Optional, Tuple
+import collections
+import os
+import statistics
+import threading
+
+from freecad_scripts.worker import VesselWorker, WorkerError
+
+
+def get_shared_threads(jobs: int, cores: Optional[int] = None) -> int:
+    """
+    Returns the number of solver threads of each of the given number of
+    concurrent jobs so that together they use the cores of the machine.
+    Without a limit CalculiX runs on all cores, which oversubscribes the
+    machine when several designs run at the same time.
+    """
+    cores = cores or os.cpu_count() or 1
+    return max(1, cores // max(1, jobs))
+
+
+class CoreBudget(object):
+    """
+    Hands out the cores of the machine to concurrent jobs. Jobs acquire
+    cores in first come first served order, so a job waiting for many cores
+    is not starved by small jobs arriving later.
+    """
+
+    def __init__(self, cores: int):
+        self.cores = cores
+        self.free = cores
+        self.condition = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+
+    def acquire(self, count: int):
+        count = min(count, self.cores)
+        with self.condition:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.condition.wait_for(
+                lambda: self.serving == ticket and self.free >= count)
+            self.free -= count
+            self.serving += 1
+            self.condition.notify_all()
+
+    def release(self, count: int):
+        count = min(count, self.cores)
+        with self.condition:
+            self.free += count
+            self.condition.notify_all()
+
+
+class CoreScheduler(object):
+    """
+    Decides the number of CalculiX threads of each job from its predicted
+    node count, and makes sure that the threads of the running jobs never
+    exceed the number of cores. Small jobs get a single thread so that many
+    of them run side by side, large jobs get one thread per nodes_per_thread
+    nodes. The node count is predicted from the body volume divided by the
+    cube of the mesh length, calibrated with the node counts of the finished
+    jobs.
+    """
+
+    def __init__(self, cores: Optional[int] = None, nodes_per_thread: int = 50000,
+                 max_threads: Optional[int] = None, window: int = 50):
+        self.cores = cores or os.cpu_count() or 1
+        self.nodes_per_thread = nodes_per_thread
+        self.max_threads = min(max_threads or self.cores, self.cores)
+        self.budget = CoreBudget(self.cores)
+        self.lock = threading.Lock()
+        # number of second order tetra nodes per unit of volume / mesh_length^3
+        self.ratios: Deque[float] = collections.deque([10.0], maxlen=window)
+
+    def predict_nodes(self, size: Optional[float]) -> Optional[float]:
+        if size is None:
+            return None
+        with self.lock:
+            return statistics.median(self.ratios) * size
+
+    def get_threads(self, size: Optional[float]) -> int:
+        nodes = self.predict_nodes(size)
+        if nodes is None:
+            return 1
+        return max(1, min(self.max_threads, int(nodes // self.nodes_per_thread)))
+
+    def update(self, size: Optional[float], node_count: Optional[float]):
+        if size and node_count:
+            with self.lock:
+                self.ratios.append(float(node_count) / size)
+
+    def acquire(self, size: Optional[float]) -> int:
+        """
+        Waits until enough cores are free for a job of the given size and
+        returns its number of threads, which must be released afterwards.
+        """
+        threads = self.get_threads(size)
+        self.budget.acquire(threads)
+        return threads
+
+    def release(self, threads: int):
+        self.budget.release(threads)
+
+    def call(self, worker: VesselWorker, method: str, params: Dict[str, Any],
+             *args) -> Tuple[Any, int]:
+        """
+        Calls the given method of the worker (evaluate or evaluate_converged)
+        on the design with the number of solver threads chosen by its
+        predicted size, once enough cores are free. Returns the row and the
+        number of threads.
+        """
+        try:
+            size = worker.call('estimate_size', params)
+        except WorkerError:
+            size = None
+
+        threads = self.acquire(size)
+        try:
+            row = worker.call(method, dict(params, solver_threads=threads), *args)
+        finally:
+            self.release(threads)
+        self.update(size, row.get('node_count'))
+        return row, threads
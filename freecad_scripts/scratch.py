@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional
+import os
+import shutil
+import socket
+import tempfile
+
+PREFIX = 'freecad_scripts_'
+RAM_ROOT = '/dev/shm'
+
+
+def get_free_space(path: str) -> int:
+    """
+    Returns the free space of the filesystem of the given path in bytes.
+    """
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def get_available_memory() -> Optional[int]:
+    """
+    Returns the memory available for new allocations in bytes, or None if
+    it is not known.
+    """
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def get_host_prefix() -> str:
+    """
+    Returns the prefix of the working directories of this host, the root
+    may be on a filesystem shared with other machines.
+    """
+    return '{}{}_'.format(PREFIX, socket.gethostname().replace('_', '-'))
+
+
+def remove_stale_dirs(root: str):
+    """
+    Removes the working directories of the processes of this host that no
+    longer exist, e.g. of killed workers, since they would keep using memory
+    on a tmpfs.
+    """
+    prefix = get_host_prefix()
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        try:
+            pid = int(name[len(prefix):].split('_')[0])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        except PermissionError:
+            pass
+
+
+class ScratchDir(object):
+    """
+    The private working directory of the solver of one process. By default
+    it is on the /dev/shm tmpfs, so input and result files never touch a
+    (network) disk, and it falls back to a directory in the system temp
+    folder when the tmpfs or the memory is running short. The files of a run
+    are removed once its results are read.
+    """
+
+    def __init__(self, root: Optional[str] = None, min_free: int = 512 * 1048576):
+        """
+        The root is the directory in which the working directory is created,
+        the fallback is used if less than min_free bytes (or twice the size
+        of the last run) are free there.
+        """
+        if root is None:
+            root = RAM_ROOT if os.access(RAM_ROOT, os.W_OK) else tempfile.gettempdir()
+        self.root = root
+        self.min_free = min_free
+        self.last_size = 0
+        self.dirs = dict()
+
+    def get_dir(self, root: str) -> str:
+        if root not in self.dirs:
+            remove_stale_dirs(root)
+            self.dirs[root] = tempfile.mkdtemp(
+                prefix='{}{}_'.format(get_host_prefix(), os.getpid()), dir=root)
+        return self.dirs[root]
+
+    def has_room(self, root: str) -> bool:
+        needed = max(self.min_free, 2 * self.last_size)
+        if get_free_space(root) < needed:
+            return False
+        if root == RAM_ROOT:
+            available = get_available_memory()
+            if available is not None and available < needed:
+                return False
+        return True
+
+    def acquire(self) -> str:
+        """
+        Returns an empty working directory for the next run.
+        """
+        root = self.root
+        if not self.has_room(root):
+            root = tempfile.gettempdir()
+        return self.get_dir(root)
+
+    def release(self, path: str):
+        """
+        Removes the files of a run from its working directory.
+        """
+        size = 0
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                size += entry.stat().st_size
+                os.remove(entry.path)
+        self.last_size = size
+
+    def close(self):
+        for path in self.dirs.values():
+            shutil.rmtree(path, ignore_errors=True)
+        self.dirs = dict()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, List, Optional, Tuple
+import concurrent.futures
+import io
+import math
+import os
+import threading
+
+import numpy
+
+from freecad_scripts.worker import VesselWorker, WorkerError
+
+DEFAULT_OUTPUTS = ['vonmises_stress', 'tresca_stress', 'max_displacement', 'body_mass']
+
+
+def get_steps(params: Dict[str, Any], names: List[str], step: float) -> Dict[str, float]:
+    """
+    Returns the finite difference step of the given parameters, which is
+    relative to their value, or absolute if the value is zero.
+    """
+    return {name: step * abs(params[name]) if params[name] else step
+            for name in names}
+
+
+def get_perturbed_designs(params: Dict[str, Any], name: str,
+                          step: float) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    lower = dict(params)
+    lower[name] = params[name] - step
+    upper = dict(params)
+    upper[name] = params[name] + step
+    return lower, upper
+
+
+class Jacobian(object):
+    """
+    The central finite difference derivatives of the outputs with respect to
+    the parameters of a design. The noise of each derivative is half of the
+    difference of its forward and backward differences, which is large if
+    the perturbed designs got a mesh of different topology or the step is
+    too large for the curvature of the output. If one of the perturbed
+    designs failed, then the one sided difference is used and the noise is
+    not known (NaN).
+    """
+
+    def __init__(self, params: Dict[str, Any], names: List[str], outputs: List[str],
+                 steps: Dict[str, float]):
+        self.params = dict(params)
+        self.names = list(names)
+        self.outputs = list(outputs)
+        self.steps = dict(steps)
+        self.base: Dict[str, Any] = dict()
+        self.gradient: Dict[str, Dict[str, float]] = {
+            output: dict() for output in outputs}
+        self.noise: Dict[str, Dict[str, float]] = {
+            output: dict() for output in outputs}
+        self.errors: Dict[str, str] = dict()
+
+    def add(self, name: str, lower: Optional[Dict[str, Any]],
+            upper: Optional[Dict[str, Any]]):
+        """
+        Computes the derivatives with respect to the given parameter from the
+        rows of the base design and the two perturbed designs, where a failed
+        design is None.
+        """
+        step = self.steps[name]
+        for output in self.outputs:
+            value = self.base[output]
+            backward = math.nan if lower is None else (value - lower[output]) / step
+            forward = math.nan if upper is None else (upper[output] - value) / step
+            if lower is None:
+                gradient = forward
+            elif upper is None:
+                gradient = backward
+            else:
+                gradient = (upper[output] - lower[output]) / (2 * step)
+            self.gradient[output][name] = gradient
+            self.noise[output][name] = abs(forward - backward) / 2
+
+    def to_numpy(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Returns the matrix of derivatives and their noise with a row for each
+        output and a column for each parameter.
+        """
+        gradient = numpy.array([[self.gradient[output][name] for name in self.names]
+                                for output in self.outputs])
+        noise = numpy.array([[self.noise[output][name] for name in self.names]
+                             for output in self.outputs])
+        return gradient, noise
+
+    def __str__(self) -> str:
+        out = io.StringIO()
+        for output in self.outputs:
+            for name in self.names:
+                out.write("d({})/d({}) = {:.6g} +- {:.3g}\n".format(
+                    output, name, self.gradient[output][name],
+                    self.noise[output][name]))
+        for name, error in self.errors.items():
+            out.write("{}: {}\n".format(name, error))
+        return out.getvalue()
+
+
+class SensitivityPool(object):
+    """
+    Worker processes that evaluate the perturbed designs of sensitivity
+    analyses concurrently. The workers are kept between the calls, so the
+    template is opened only once and a gradient costs about one analysis of
+    wall time if there are enough cores.
+    """
+
+    def __init__(self, filename: str, defaults: Optional[Dict[str, Any]] = None,
+                 jobs: Optional[int] = None, debug=False):
+        self.filename = filename
+        self.defaults = dict(defaults or {})
+        self.jobs = jobs or os.cpu_count() or 1
+        self.debug = debug
+        self.workers: List[VesselWorker] = []
+        self.threads: List[threading.Thread] = []
+
+    def submit(self, designs: List[Dict[str, Any]]) -> List[concurrent.futures.Future]:
+        """
+        Starts the evaluation of the given designs in the background and
+        returns a future of the row of each design. The designs are dealt out
+        to the workers in turn.
+        """
+        self.join()
+        count = min(len(designs), self.jobs)
+        while len(self.workers) < count:
+            self.workers.append(VesselWorker(self.filename, defaults=self.defaults,
+                                             debug=self.debug))
+
+        futures = [concurrent.futures.Future() for _ in designs]
+        for index in range(count):
+            thread = threading.Thread(target=self._run, args=(
+                self.workers[index], designs[index::count], futures[index::count]))
+            thread.start()
+            self.threads.append(thread)
+        return futures
+
+    def _run(self, worker: VesselWorker, designs: List[Dict[str, Any]],
+             futures: List[concurrent.futures.Future]):
+        for params, future in zip(designs, futures):
+            try:
+                future.set_result(worker.evaluate(params))
+            except WorkerError as err:
+                future.set_exception(err)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def close(self):
+        self.join()
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
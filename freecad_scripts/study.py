@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import csv
+import random
+import time
+
+from freecad_scripts.convergence import MeshConvergence
+from freecad_scripts.csvfiles import csv_open_output, csv_close_output
+from freecad_scripts.metrics import StudyMetrics
+from freecad_scripts.resultstore import ResultStore, get_template_hash
+from freecad_scripts.scheduler import CoreScheduler
+from freecad_scripts.worker import VesselWorker, WorkerError
+
+
+def random_design(sketch_params: List[str], rng=random) -> Dict[str, Any]:
+    """
+    Returns random sketch lengths for the given sketch parameters and a
+    mesh length relative to the size of the body.
+    """
+    params = dict()
+    for name in sketch_params:
+        if 'thickness' in name:
+            value = rng.uniform(0.001, 0.01)
+        elif 'length' in name:
+            value = rng.uniform(0.0, 2.0)
+        elif 'radius' in name:
+            value = rng.uniform(0.1, 1.0)
+        else:
+            value = rng.uniform(0.0, 1.0)
+        params[name] = value
+    params['relative_mesh_length'] = 0.04
+    return params
+
+
+def random_designs(sketch_params: List[str], count: int, seed: Optional[str] = None,
+                   shard: Tuple[int, int] = (0, 1)) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Generates the random designs of the given shard of a study with their
+    index. With a seed each design has its own random generator seeded by
+    the seed and its index, so every shard generates only its own designs
+    and they are the same as in an unsharded study with the same seed.
+    """
+    for index in range(shard[0], count, shard[1]):
+        if seed is None:
+            rng = random
+        else:
+            rng = random.Random('{}:{}'.format(seed, index))
+        yield index, random_design(sketch_params, rng)
+
+
+def shard_designs(designs: Iterable[Dict[str, Any]],
+                  shard: Tuple[int, int] = (0, 1)) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Returns the designs of the given shard (the ones whose index has the
+    shard number as remainder modulo the number of shards) with their index.
+    """
+    return shard_items(enumerate(designs), shard)
+
+
+def shard_items(items: Iterable[Tuple[int, Dict[str, Any]]],
+                shard: Tuple[int, int] = (0, 1)) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Returns the designs of the given shard by their position, for designs
+    given with their own index, see shard_designs.
+    """
+    for position, item in enumerate(items):
+        if position % shard[1] == shard[0]:
+            yield item
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """
+    Parses a shard given as i/n, where 0 <= i < n.
+    """
+    try:
+        shard, count = map(int, text.split('/'))
+    except ValueError:
+        raise ValueError("Invalid shard: " + text)
+    if not 0 <= shard < count:
+        raise ValueError("Invalid shard: " + text)
+    return shard, count
+
+
+# the columns of the design point files without header, see models/designspace.txt
+DESIGN_POINT_COLUMNS = ['index', 'depth', 'length', 'thickness']
+
+
+def read_rows(filename: str, columns: Optional[List[str]] = None) -> Iterator[Dict[str, str]]:
+    """
+    Reads the rows of a CSV file with a header row, or of a comma or white
+    space separated file of numbers without header, whose columns are given
+    by their names (DESIGN_POINT_COLUMNS by default).
+    """
+    with open(filename, newline='', encoding='utf-8') as file:
+        first = file.readline()
+        file.seek(0)
+        delimiter = ',' if ',' in first else None
+        try:
+            [float(value) for value in first.split(delimiter)]
+        except ValueError:
+            yield from csv.DictReader(file)
+            return
+
+        columns = columns or DESIGN_POINT_COLUMNS
+        for number, line in enumerate(file, 1):
+            values = line.split(delimiter)
+            if not line.strip():
+                continue
+            if len(values) != len(columns):
+                raise ValueError("Expected {} columns ({}) on line {} of {}".format(
+                    len(columns), ', '.join(columns), number, filename))
+            yield dict(zip(columns, (value.strip() for value in values)))
+
+
+def read_indexed_designs(filename: str, columns: Optional[List[str]] = None) -> Iterator[
+        Tuple[int, Dict[str, Any]]]:
+    """
+    Reads design points with their index from a file, see read_rows. The
+    index column of the file is used if it has one, otherwise the position
+    of the row. The other columns are parameter names, e.g. thickness,
+    radius, length, pressure, depth and mesh_length.
+    """
+    for position, row in enumerate(read_rows(filename, columns)):
+        params = {name: float(value) for name, value in row.items()
+                  if name != 'index' and value != ''}
+        index = row.get('index', '')
+        yield (position if index == '' else int(float(index))), params
+
+
+def read_designs(filename: str, columns: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Reads design points from a file without their index, see
+    read_indexed_designs.
+    """
+    for _, params in read_indexed_designs(filename, columns):
+        yield params
+
+
+MESH_PARAMS = ['mesh_length', 'relative_mesh_length']
+MATERIAL_PARAMS = ['youngs_modulus', 'poisson_ratio', 'tensile_strength', 'density']
+
+
+def group_designs(designs: Iterable[Dict[str, Any]],
+                  sketch_params: List[str]) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Reorders the designs so that the ones with the same geometry (sketch
+    lengths and mesh length) and within those the ones with the same material
+    are consecutive, so only the cheap parameters change between them. Returns
+    the designs with their original index, groups are kept in the order of
+    their first design.
+    """
+    return group_items(enumerate(designs), sketch_params)
+
+
+def group_items(items: Iterable[Tuple[int, Dict[str, Any]]],
+                sketch_params: List[str]) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Reorders designs given with their index, see group_designs.
+    """
+    groups: Dict[tuple, Dict[tuple, List[Tuple[int, Dict[str, Any]]]]] = dict()
+    for index, params in items:
+        geometry = tuple(params.get(name) for name in sketch_params + MESH_PARAMS)
+        material = tuple(params.get(name) for name in MATERIAL_PARAMS)
+        groups.setdefault(geometry, dict()).setdefault(material, []).append(
+            (index, params))
+
+    return [item for materials in groups.values()
+            for group in materials.values() for item in group]
+
+
+def merge_outputs(filenames: List[str], output: str) -> int:
+    """
+    Merges the output files of the shards of a study into one file ordered
+    by the template and design index, and returns the number of rows.
+    """
+    fieldnames: List[str] = []
+    rows = []
+    for filename in filenames:
+        with open(filename, newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            for name in reader.fieldnames or []:
+                if name not in fieldnames:
+                    fieldnames.append(name)
+            rows.extend(reader)
+
+    if 'error' in fieldnames:
+        fieldnames.remove('error')
+        fieldnames.append('error')
+    rows.sort(key=lambda row: (row.get('template', ''), int(float(row['index']))))
+
+    writer = csv_open_output(output, fieldnames)
+    for row in rows:
+        writer.writerow(row)
+    csv_close_output(writer)
+    return len(rows)
+
+
+class StudyRunner(object):
+    """
+    Runs a study of many designs on a worker process that is recycled when
+    its memory usage or number of runs reaches the given limits. The output
+    file is kept open across restarts, failed designs are written with their
+    error message.
+    """
+
+    def __init__(self, filename: str, defaults: Optional[Dict[str, Any]] = None,
+                 max_memory: Optional[int] = None, max_runs: Optional[int] = None,
+                 convergence: Optional[MeshConvergence] = None,
+                 metrics: Optional[StudyMetrics] = None,
+                 store: Optional[ResultStore] = None,
+                 scheduler: Optional[CoreScheduler] = None, debug=False):
+        """
+        If convergence is given, then each design is refined with a mesh
+        convergence sweep instead of a single analysis. If metrics is given,
+        then the progress of the study is recorded there. If store is given,
+        then designs already in the store are not run again, and the new
+        results are added to it. If scheduler is given, then the solver
+        threads of each design are chosen by its predicted size.
+        """
+        self.worker = VesselWorker(filename, defaults=defaults,
+                                   max_memory=max_memory, max_runs=max_runs,
+                                   debug=debug)
+        self.convergence = convergence
+        self.metrics = metrics
+        self.store = store
+        self.scheduler = scheduler
+        self.template_hash = None if store is None else get_template_hash(filename)
+        self.debug = debug
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def sketch_params(self) -> List[str]:
+        self.worker.start()
+        return self.worker.sketch_params
+
+    def get_fieldnames(self) -> List[str]:
+        self.worker.start()
+        fieldnames = ['index'] + self.worker.fieldnames
+        if self.convergence is not None:
+            fieldnames.extend(['converged', 'mesh_iterations'])
+        return fieldnames + ['error']
+
+    def evaluate(self, index: int, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Evaluates a single design and returns its output row. Errors are
+        recorded in the row instead of being raised.
+        """
+        start = time.perf_counter()
+        request = dict(self.worker.defaults, **params)
+        if self.convergence is not None:
+            request['convergence'] = self.convergence.mesh_options
+        if self.store is not None:
+            row = self.store.lookup(self.template_hash, request)
+            if row is not None:
+                row['index'] = index
+                self.completed += 1
+                if self.metrics is not None:
+                    self.metrics.record(time.perf_counter() - start,
+                                        cache={'store': True})
+                return row
+
+        try:
+            if self.convergence is None:
+                row = self.call('evaluate', params)
+            else:
+                row = self.call(
+                    'evaluate_converged', params, self.convergence.mesh_options,
+                    self.convergence.window, self.convergence.threshold,
+                    self.convergence.get_start(params))
+                self.convergence.update(params, row)
+            row['error'] = ''
+            self.completed += 1
+            if self.store is not None:
+                self.store.insert(self.template_hash,
+                                  dict(self.worker.defaults, **row), request)
+        except WorkerError as err:
+            row = dict(params)
+            row['error'] = str(err)
+            self.failed += 1
+        row['index'] = index
+        if self.metrics is not None:
+            cache = dict(self.worker.cache_hits)
+            if self.store is not None:
+                cache['store'] = False
+            self.metrics.record(time.perf_counter() - start, row['error'],
+                                self.worker.timings, cache)
+        return row
+
+    def call(self, method: str, params: Dict[str, Any], *args) -> Any:
+        if self.scheduler is None:
+            return self.worker.call(method, params, *args)
+        return self.scheduler.call(self.worker, method, params, *args)[0]
+
+    def get_feasible(self, items: Iterable[Tuple[int, Dict[str, Any]]]) -> Tuple[
+            List[Tuple[int, Dict[str, Any]]], List[Tuple[int, Dict[str, Any], str]]]:
+        """
+        Splits the indexed designs into the ones that satisfy the inequalities
+        implied by the sketch constraints and the rejected ones.
+        """
+        self.worker.start()
+        if self.worker.feasibility is None:
+            return list(items), []
+        return self.worker.feasibility.split(items)
+
+    def run(self, designs: Iterable[Dict[str, Any]], output: str, group=False,
+            check=False, indexed=False):
+        """
+        Evaluates the designs and writes their rows to the output. If group
+        is set, then designs with the same geometry and material are run
+        consecutively and the rows are written in this order, tagged with
+        their original index. If check is set, then designs violating the
+        sketch constraints are written with their error without running them.
+        If indexed is set, then the designs are given as (index, params)
+        pairs, e.g. the designs of a shard.
+        """
+        items = designs if indexed else enumerate(designs)
+        if group:
+            items = group_items(items, self.sketch_params)
+        else:
+            items = list(items)
+        if self.metrics is not None:
+            self.metrics.set_total(len(items))
+
+        writer = csv_open_output(output, self.get_fieldnames())
+        try:
+            if self.metrics is not None:
+                self.metrics.start()
+            if check:
+                items, rejected = self.get_feasible(items)
+                for index, params, reason in rejected:
+                    row = dict(params, index=index, error='Infeasible: ' + reason)
+                    writer.writerow({name: row.get(name, '')
+                                     for name in writer.fieldnames})
+                self.failed += len(rejected)
+                if self.metrics is not None:
+                    self.metrics.record_rejected(len(rejected))
+                if self.debug:
+                    print("Rejected", len(rejected), "infeasible designs")
+
+            for position, (index, params) in enumerate(items):
+                if self.metrics is not None:
+                    self.metrics.set_queue_depth(
+                        {'pending': len(items) - position - 1, 'running': 1})
+                row = self.evaluate(index, params)
+                writer.writerow({name: row.get(name, '')
+                                 for name in writer.fieldnames})
+                if self.debug:
+                    print("Design {} done, {} failed, {} restarts, {:.1f} MB".format(
+                        index, self.failed, self.worker.restarts,
+                        self.worker.memory / 1048576))
+        finally:
+            csv_close_output(writer)
+            self.worker.stop()
+            if self.metrics is not None:
+                self.metrics.set_queue_depth({'pending': 0, 'running': 0})
+                self.metrics.stop()
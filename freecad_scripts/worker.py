@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Dict, List, Optional
+import multiprocessing
+import os
+import resource
+
+from freecad_scripts.feasibility import FeasibilityChecker
+
+
+def get_memory_usage() -> int:
+    """
+    Returns the resident set size of the current process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # peak usage in kilobytes, but better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_main(conn, filename: str, defaults: Dict[str, Any], debug: bool):
+    # FreeCAD is imported only in the child process
+    from freecad_scripts.pressure_vessel import PressureVessel
+
+    vessel = PressureVessel(filename, debug=debug)
+    for name, value in defaults.items():
+        vessel.set(name, value)
+    try:
+        checker = FeasibilityChecker.from_vessel(vessel)
+    except Exception as err:
+        print("WARNING: cannot derive sketch feasibility:", err)
+        checker = None
+    conn.send({
+        'sketch_params': vessel.sketch_params,
+        'fieldnames': vessel.get_fieldnames(),
+        'feasibility': checker,
+        'memory': get_memory_usage(),
+    })
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            value = getattr(vessel, method)(*args)
+            error = None
+        except Exception as err:
+            value = None
+            error = '{}: {}'.format(type(err).__name__, err)
+        conn.send({
+            'value': value,
+            'error': error,
+            'memory': get_memory_usage(),
+            'timings': getattr(vessel, 'timings', {}),
+            'cache_hits': getattr(vessel, 'cache_hits', {}),
+        })
+    vessel.close()
+    conn.close()
+
+
+class WorkerError(Exception):
+    pass
+
+
+class VesselWorker(object):
+    """
+    Evaluates designs of a pressure vessel template in a separate process.
+    FreeCAD and the FEM mesh objects leak memory, so the process is restarted
+    and the template reopened once it grows above the memory limit or has
+    run the given number of analyses.
+    """
+
+    def __init__(self, filename: str, defaults: Optional[Dict[str, Any]] = None,
+                 max_memory: Optional[int] = None, max_runs: Optional[int] = None,
+                 debug=False):
+        """
+        The defaults are set on the freshly opened template after each
+        restart, the max_memory limit is in bytes.
+        """
+        self.filename = filename
+        self.defaults = dict(defaults or {})
+        self.max_memory = max_memory
+        self.max_runs = max_runs
+        self.debug = debug
+
+        self.process = None
+        self.conn = None
+        self.runs = 0
+        self.memory = 0
+        self.restarts = 0
+        self.sketch_params: List[str] = []
+        self.fieldnames: List[str] = []
+        self.feasibility: Optional[FeasibilityChecker] = None
+        self.timings: Dict[str, float] = dict()
+        self.cache_hits: Dict[str, bool] = dict()
+
+    def start(self):
+        if self.process is not None:
+            return
+
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, self.filename, self.defaults, self.debug),
+            daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        try:
+            info = self.conn.recv()
+        except EOFError:
+            self._kill()
+            raise WorkerError("Could not open template: " + self.filename)
+
+        self.sketch_params = info['sketch_params']
+        self.fieldnames = info['fieldnames']
+        self.feasibility = info['feasibility']
+        self.memory = info['memory']
+        self.runs = 0
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout=10)
+        self._kill()
+
+    def _kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def restart(self):
+        if self.debug:
+            print("Restarting worker after {} runs using {:.1f} MB".format(
+                self.runs, self.memory / 1048576))
+        self.stop()
+        self.start()
+        self.restarts += 1
+
+    def needs_restart(self) -> bool:
+        if self.max_memory is not None and self.memory >= self.max_memory:
+            return True
+        if self.max_runs is not None and self.runs >= self.max_runs:
+            return True
+        return False
+
+    def evaluate(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Runs the analysis on the given design and returns the row of all
+        parameters and outputs. Raises a WorkerError if the analysis failed
+        or the worker process died, in which case it is restarted on the
+        next call.
+        """
+        return self.call('evaluate', params)
+
+    def call(self, method: str, *args) -> Any:
+        """
+        Calls the given method of the PressureVessel object in the worker
+        process and returns its value, see evaluate.
+        """
+        if self.process is not None and self.needs_restart():
+            self.restart()
+        elif self.process is None and self.runs:
+            self.restarts += 1
+        self.start()
+
+        self.runs += 1
+        self.timings = dict()
+        self.cache_hits = dict()
+        try:
+            self.conn.send((method, args))
+            result = self.conn.recv()
+        except (OSError, EOFError):
+            self._kill()
+            raise WorkerError("Worker process died")
+
+        self.memory = result['memory']
+        self.timings = result['timings']
+        self.cache_hits = result['cache_hits']
+        if result['error'] is not None:
+            raise WorkerError(result['error'])
+        return result['value']
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
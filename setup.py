@@ -25,6 +25,7 @@ setup(
     python_requires='>3.6',
     # do not list standard packages
     install_requires=[
+        'numpy',
     ],
     entry_points={
         'console_scripts': [
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+from freecad_scripts.feasibility import FeasibilityChecker
+
+
+class Arc(object):
+    def __init__(self, radius):
+        self.Radius = radius
+
+
+class Point(object):
+    def __init__(self, x):
+        self.x = x
+
+    def distanceToPoint(self, other):
+        return abs(other.x - self.x)
+
+
+class Line(object):
+    def __init__(self, length):
+        self.StartPoint = Point(0.0)
+        self.EndPoint = Point(length)
+
+
+class Sketch(object):
+    def __init__(self, vessel):
+        self.vessel = vessel
+
+    @property
+    def Geometry(self):
+        values = self.vessel.values
+        return [Arc(values['radius'] * 1e3),
+                Arc((values['radius'] - values['thickness']) * 1e3),
+                Line(values['length'] * 1e3),
+                Line(values['length'] * 1e3)]
+
+
+class Document(object):
+    def __init__(self, sketch):
+        self.sketch = sketch
+
+    def getObject(self, name):
+        assert name == 'Sketch'
+        return self.sketch
+
+
+class Capsule(object):
+    sketch_params = ['radius', 'thickness', 'length']
+
+    def __init__(self):
+        self.values = {'radius': 0.5, 'thickness': 0.01, 'length': 2.0}
+        self.doc = Document(Sketch(self))
+
+    def sketch_get_length(self, name):
+        return self.values[name]
+
+    def sketch_set_length(self, name, value):
+        self.values[name] = value
+
+
+def get_checker():
+    return FeasibilityChecker(['thickness', 'radius'], [0.01, 0.5],
+                              [[0.0, 1.0], [-1.0, 1.0]], [0.0, 0.0])
+
+
+def test_check_returns_first_violated_inequality():
+    checker = get_checker()
+    result = checker.check([
+        {'thickness': 0.02, 'radius': 0.4},
+        {'thickness': 0.6, 'radius': 0.5},
+        {'thickness': 0.1, 'radius': -0.1},
+        {'thickness': 0.6},
+        {'radius': 0.02, 'depth': 100.0},
+    ])
+    assert list(result) == [-1, 1, 0, 1, -1]
+
+
+def test_check_array_uses_base_for_missing_columns():
+    checker = get_checker()
+    values = numpy.array([[0.3, 1.0], [0.005, 1.0]])
+    assert list(checker.check_array(values, ['radius', 'depth'])) == [-1, 1]
+
+
+def test_split_describes_rejected_designs():
+    checker = get_checker()
+    feasible, rejected = checker.split([
+        (3, {'thickness': 0.02, 'radius': 0.4}),
+        (7, {'thickness': 0.5, 'radius': 0.5}),
+    ])
+    assert feasible == [(3, {'thickness': 0.02, 'radius': 0.4})]
+    assert rejected == [(7, {'thickness': 0.5, 'radius': 0.5},
+                         'radius - thickness > 0')]
+
+
+def test_from_vessel_derives_inequalities():
+    vessel = Capsule()
+    checker = FeasibilityChecker.from_vessel(vessel)
+    assert vessel.values == {'radius': 0.5, 'thickness': 0.01, 'length': 2.0}
+    assert checker.get_descriptions() == [
+        'radius > 0', 'radius - thickness > 0', 'length > 0']
+    assert list(checker.check([
+        {'radius': 0.3, 'thickness': 0.02, 'length': 1.0},
+        {'radius': 0.3, 'thickness': 0.3, 'length': 1.0},
+        {'length': -1.0},
+    ])) == [-1, 1, 2]
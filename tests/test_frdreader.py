@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+
+import numpy
+import pytest
+
+from freecad_scripts.frdreader import get_result_summary, read_frd_results
+
+
+def record(node, values):
+    return ' -1{:10d}'.format(node) + ''.join('{:12.5E}'.format(v) for v in values)
+
+
+def block(name, components, rows, split=False):
+    lines = [' -4  {:8}{:4d}    1'.format(name, len(components))]
+    lines.extend(' -5  {:8}    1    2    0    0'.format(comp) for comp in components)
+    for node, values in rows:
+        if split:
+            lines.append(record(node, values[:3]))
+            lines.append(' -2' + ' ' * 10 + ''.join(
+                '{:12.5E}'.format(v) for v in values[3:]))
+        else:
+            lines.append(record(node, values))
+    lines.append(' -3')
+    return lines
+
+
+def frd_text(split=False):
+    lines = ['    1C', '    1UDATE  19.october.2026', '    2C                             2',
+             record(1, [0.0, 0.0, 0.0]), record(2, [1.0, 0.0, 0.0]), ' -3',
+             '    1PSTEP                         1           1           1']
+    lines += block('DISP', ['D1', 'D2', 'D3', 'ALL'],
+                   [(1, [0.0, 0.0, 0.0]), (2, [3.0, 4.0, 0.0])])
+    lines += block('STRESS', ['SXX', 'SYY', 'SZZ', 'SXY', 'SYZ', 'SZX'],
+                   [(1, [100.0, 0.0, 0.0, 0.0, 0.0, 0.0]),
+                    (2, [10.0, 0.0, 0.0, 0.0, 0.0, 0.0])], split=split)
+    lines.append(' 9999')
+    return '\n'.join(lines) + '\n'
+
+
+def write_frd(tmp_path, text):
+    path = tmp_path / 'result.frd'
+    path.write_text(text)
+    return str(path)
+
+
+def test_read_blocks(tmp_path):
+    results = read_frd_results(write_frd(tmp_path, frd_text()))
+    assert sorted(results) == ['DISP', 'STRESS']
+    nodes, values = results['DISP']
+    assert list(nodes) == [1, 2]
+    assert values.shape == (2, 3)
+    assert numpy.allclose(values[1], [3.0, 4.0, 0.0])
+    assert results['STRESS'][1].shape == (2, 6)
+
+
+def test_continued_records_match_columns(tmp_path):
+    columns = read_frd_results(io.BytesIO(frd_text().encode()))
+    records = read_frd_results(io.BytesIO(frd_text(split=True).encode()))
+    assert numpy.array_equal(columns['STRESS'][0], records['STRESS'][0])
+    assert numpy.allclose(columns['STRESS'][1], records['STRESS'][1])
+
+
+def test_summary(tmp_path):
+    summary = get_result_summary(write_frd(tmp_path, frd_text()))
+    assert summary['vonmises_stress'] == pytest.approx(100.0)
+    assert summary['tresca_stress'] == pytest.approx(50.0)
+    assert summary['max_displacement'] == pytest.approx(0.005)
+
+
+def test_missing_results_raise_value_error(tmp_path):
+    with pytest.raises(ValueError, match='FEM error'):
+        get_result_summary(str(tmp_path / 'missing.frd'))
+    text = frd_text()
+    with pytest.raises(ValueError, match='FEM error'):
+        get_result_summary(write_frd(tmp_path, text[:text.index(' -4  STRESS')]))
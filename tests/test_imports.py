@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules that can be used without FreeCAD
+MODULES = [
+    'artifacts', 'asyncvessel', 'batch', 'convergence', 'csvfiles',
+    'feasibility', 'frdreader', 'inpwriter', 'jobqueue', 'metrics',
+    'profiling', 'resultstore', 'scheduler', 'scratch', 'sensitivity',
+    'study', 'worker',
+]
+
+
+@pytest.mark.parametrize('name', MODULES)
+def test_import(name):
+    # each module is imported first in a fresh interpreter to catch cycles
+    subprocess.run([sys.executable, '-c', 'import freecad_scripts.' + name],
+                   cwd=ROOT, check=True)
+
+
+def test_lookup_booleans(tmp_path):
+    from freecad_scripts.resultstore import ResultStore
+
+    store = ResultStore(str(tmp_path / 'results.db'))
+    store.insert('template', {'thickness': 0.01, 'vonmises_stress': 100.0,
+                              'has_failed': False})
+    row = store.lookup('template', {'thickness': 0.01})
+    assert row['has_failed'] is False
+    store.close()
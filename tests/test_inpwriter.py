@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from freecad_scripts.inpwriter import InpTemplate
+
+DECK = """** written by FreeCAD inp file writer for CalculiX,Abaqus meshes
+*NODE, NSET=Nall
+1, 0.0, 0.0, 0.0
+2, 1.0, 0.0, 0.0
+*ELEMENT, TYPE=C3D10, ELSET=Eall
+1, 1, 2
+** Materials
+*MATERIAL, NAME=Aluminium
+*ELASTIC
+70000, 0.350
+*DENSITY
+2.700e-09
+*STEP
+*STATIC
+*DLOAD
+** ConstraintPressure
+Eall,P3,-1.5
+Eall,P4,2.0
+*END STEP
+**
+** CalculiX Input file
+**   written on    --> Mon Oct 19 10:00:00 2026
+"""
+
+
+def test_patch_material_and_pressure():
+    template = InpTemplate('key', DECK, 'model.inp')
+    text = template.patch(200000.0, 0.3, 7900.0, 3.25)
+    lines = text.splitlines()
+    assert lines[lines.index('*ELASTIC') + 1] == '200000, 0.300'
+    assert lines[lines.index('*DENSITY') + 1] == '7.900e-09'
+    assert 'Eall,P3,-3.25' in lines
+    assert 'Eall,P4,3.25' in lines
+    # the mesh and everything else is unchanged
+    assert text.replace('200000, 0.300', '70000, 0.350').replace(
+        '7.900e-09', '2.700e-09').replace('-3.25', '-1.5').replace(
+        'P4,3.25', 'P4,2.0') == DECK
+
+
+def test_patch_with_same_values_reproduces_deck():
+    template = InpTemplate('key', DECK, 'model.inp')
+    assert template.patch(70000.0, 0.35, 2700.0, 2.0).replace(
+        'P3,-2.0', 'P3,-1.5') == DECK
+
+
+def test_matches_ignores_comments():
+    template = InpTemplate('key', DECK, 'model.inp')
+    text = template.patch(70000.0, 0.35, 2700.0, 1.5).replace('P4,1.5', 'P4,2.0')
+    later = DECK.replace('10:00:00', '10:05:00')
+    assert text != later
+    assert template.matches(later, text)
+    assert not template.matches(later, text.replace('2.700e-09', '2.800e-09'))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import pytest
+
+from freecad_scripts.jobqueue import JobQueue
+
+
+def create_queue(tmp_path, lease_time=3600.0, count=3):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), lease_time=lease_time)
+    queue.submit(str(tmp_path / 'model.FCStd'), ['thickness', 'vonmises_stress'],
+                 [(index, {'thickness': 0.01 * (index + 1)}) for index in range(count)],
+                 defaults={'analysis_mode': '3d'})
+    return queue
+
+
+def test_claim_order_and_results(tmp_path):
+    queue = create_queue(tmp_path)
+    assert queue.get_meta('defaults') == {'analysis_mode': '3d'}
+
+    job1, index1, params1 = queue.claim('w1')
+    job2, index2, _ = queue.claim('w2')
+    assert (index1, index2) == (0, 1)
+    assert params1 == {'thickness': 0.01}
+
+    assert queue.complete(job2, 'w2', {'thickness': 0.02, 'vonmises_stress': 5.0})
+    assert queue.fail(job1, 'w1', 'WorkerError: failed')
+    assert queue.get_counts() == {'pending': 1, 'running': 0, 'done': 1, 'failed': 1}
+
+    rows = list(queue.get_results())
+    assert [row['index'] for row in rows] == [0, 1]
+    assert rows[0]['error'] == 'WorkerError: failed'
+    assert rows[1]['vonmises_stress'] == 5.0
+    queue.close()
+
+
+def test_expired_lease_is_requeued(tmp_path):
+    queue = create_queue(tmp_path, lease_time=0.1, count=1)
+    job, _, _ = queue.claim('dead')
+    time.sleep(0.2)
+    assert queue.requeue_expired() == 1
+    assert queue.claim('w1')[0] == job
+    queue.close()
+
+
+def test_renew_keeps_the_lease(tmp_path):
+    queue = create_queue(tmp_path, lease_time=0.3, count=1)
+    job, _, _ = queue.claim('w1')
+    time.sleep(0.2)
+    assert queue.renew(job, 'w1')
+    time.sleep(0.2)
+    assert queue.claim('w2') is None
+    assert not queue.renew(job, 'w2')
+    queue.close()
+
+
+def test_too_many_expired_leases_fail(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), lease_time=0.05, max_attempts=2)
+    queue.submit(str(tmp_path / 'model.FCStd'), ['thickness'], [(0, {'thickness': 1.0})])
+    for worker in ['w1', 'w2']:
+        assert queue.claim(worker) is not None
+        time.sleep(0.1)
+    assert queue.claim('w3') is None
+    assert queue.get_counts()['failed'] == 1
+    queue.close()
+
+
+def test_stale_worker_cannot_finish_job(tmp_path):
+    # w1 loses its lease, w2 takes over the job, then w1 reports
+    queue = create_queue(tmp_path, lease_time=0.1, count=1)
+    job, _, _ = queue.claim('w1')
+    time.sleep(0.2)
+    assert queue.claim('w2')[0] == job
+
+    assert not queue.renew(job, 'w1')
+    assert not queue.fail(job, 'w1', 'WorkerError: stale')
+    assert not queue.complete(job, 'w1', {'thickness': 0.01})
+    assert queue.get_counts()['running'] == 1
+
+    # the job is requeued if w2 dies as well
+    time.sleep(0.2)
+    assert queue.claim('w3')[0] == job
+    assert queue.complete(job, 'w3', {'thickness': 0.01})
+    assert queue.get_counts()['done'] == 1
+    queue.close()
+
+
+def test_template_is_fixed(tmp_path):
+    queue = create_queue(tmp_path)
+    with pytest.raises(ValueError):
+        queue.submit(str(tmp_path / 'other.FCStd'), ['thickness'], [])
+    queue.close()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from freecad_scripts.scheduler import CoreBudget, CoreScheduler, get_shared_threads
+from freecad_scripts.worker import WorkerError
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_shared_threads():
+    assert get_shared_threads(4, cores=16) == 4
+    assert get_shared_threads(3, cores=16) == 5
+    assert get_shared_threads(32, cores=16) == 1
+    assert get_shared_threads(0, cores=8) == 8
+
+
+def test_budget_serves_jobs_in_order():
+    budget = CoreBudget(4)
+    budget.acquire(3)
+    order = []
+
+    def job(name, count):
+        budget.acquire(count)
+        order.append(name)
+
+    large = threading.Thread(target=job, args=('large', 2))
+    large.start()
+    wait_for(lambda: budget.next_ticket == 2)
+    small = threading.Thread(target=job, args=('small', 1))
+    small.start()
+    wait_for(lambda: budget.next_ticket == 3)
+
+    # the small job would fit, but it must not overtake the large one
+    time.sleep(0.1)
+    assert order == []
+    budget.release(3)
+    large.join(5.0)
+    small.join(5.0)
+    assert order == ['large', 'small']
+    assert budget.free == 1
+
+
+def test_budget_caps_requests_at_cores():
+    budget = CoreBudget(2)
+    budget.acquire(8)
+    assert budget.free == 0
+    budget.release(8)
+    assert budget.free == 2
+
+
+class FakeWorker(object):
+    def __init__(self, size):
+        self.size = size
+        self.calls = []
+
+    def call(self, method, params, *args):
+        if method == 'estimate_size':
+            if self.size is None:
+                raise WorkerError('no estimate')
+            return self.size
+        self.calls.append((method, params, args))
+        return {'node_count': 400000.0}
+
+
+def test_scheduler_threads_from_predicted_size():
+    scheduler = CoreScheduler(cores=8, nodes_per_thread=50000)
+    worker = FakeWorker(20000.0)
+    row, threads = scheduler.call(worker, 'evaluate', {'thickness': 0.01})
+    assert threads == 4
+    assert worker.calls == [('evaluate', {'thickness': 0.01, 'solver_threads': 4}, ())]
+    assert row == {'node_count': 400000.0}
+    assert scheduler.budget.free == 8
+    # calibrated with the node count of the finished job: 20 nodes per unit
+    assert scheduler.get_threads(20000.0) == 6
+
+
+def test_scheduler_single_thread_without_estimate():
+    scheduler = CoreScheduler(cores=8)
+    worker = FakeWorker(None)
+    _, threads = scheduler.call(worker, 'evaluate_converged', {}, 0.01)
+    assert threads == 1
+    assert worker.calls == [('evaluate_converged', {'solver_threads': 1}, (0.01,))]
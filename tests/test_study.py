@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021, Miklos Maroti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from freecad_scripts import study
+
+
+def test_read_csv_with_header_keeps_index(tmp_path):
+    path = tmp_path / 'designs.csv'
+    path.write_text('index,thickness,radius\n7,0.01,0.5\n3,0.02,\n')
+    assert list(study.read_indexed_designs(str(path))) == [
+        (7, {'thickness': 0.01, 'radius': 0.5}),
+        (3, {'thickness': 0.02})]
+    assert list(study.read_designs(str(path)))[0] == {'thickness': 0.01, 'radius': 0.5}
+
+
+def test_read_csv_without_index_uses_position(tmp_path):
+    path = tmp_path / 'designs.csv'
+    path.write_text('thickness,radius\n0.01,0.5\n0.02,0.6\n')
+    assert [index for index, _ in study.read_indexed_designs(str(path))] == [0, 1]
+
+
+@pytest.mark.parametrize('delimiter', [' ', ','])
+def test_read_design_points_without_header(tmp_path, delimiter):
+    path = tmp_path / 'points.txt'
+    path.write_text(delimiter.join(['9.818e+03', '6.0e+02', '5.0e-01', '1.8e-01']) + '\n'
+                    + delimiter.join(['1.944e+03', '4.9e+03', '1.0e-01', '2.4e-01']) + '\n')
+    assert list(study.read_indexed_designs(str(path))) == [
+        (9818, {'depth': 600.0, 'length': 0.5, 'thickness': 0.18}),
+        (1944, {'depth': 4900.0, 'length': 0.1, 'thickness': 0.24})]
+
+
+def test_read_design_points_checks_columns(tmp_path):
+    path = tmp_path / 'points.txt'
+    path.write_text('1 2 3\n')
+    with pytest.raises(ValueError):
+        list(study.read_indexed_designs(str(path)))
+    assert list(study.read_indexed_designs(str(path), ['index', 'radius', 'length'])) == [
+        (1, {'radius': 2.0, 'length': 3.0})]
+
+
+def test_group_keeps_file_index(tmp_path):
+    path = tmp_path / 'points.txt'
+    path.write_text('5 100 1.0 0.01\n6 200 2.0 0.01\n7 300 1.0 0.01\n')
+    items = study.group_items(study.read_indexed_designs(str(path)), ['length', 'thickness'])
+    assert [index for index, _ in items] == [5, 7, 6]
+
+
+def test_random_design_shards_match_unsharded_study():
+    params = ['radius', 'thickness', 'length']
+    whole = list(study.random_designs(params, 10, seed='abc'))
+    assert [index for index, _ in whole] == list(range(10))
+    shards = [list(study.random_designs(params, 10, seed='abc', shard=(i, 3)))
+              for i in range(3)]
+    assert [index for index, _ in shards[1]] == [1, 4, 7]
+    assert sorted(sum(shards, []), key=lambda item: item[0]) == whole
+    assert whole != list(study.random_designs(params, 10, seed='xyz'))
+
+
+def test_shard_items_by_position():
+    items = [(9, {}), (2, {}), (5, {}), (1, {})]
+    assert list(study.shard_items(items, (1, 2))) == [(2, {}), (1, {})]
+    assert list(study.shard_designs([{'a': 0}, {'a': 1}, {'a': 2}], (0, 2))) == [
+        (0, {'a': 0}), (2, {'a': 2})]
+
+
+@pytest.mark.parametrize('text', ['2/2', '-1/2', '1', 'a/b'])
+def test_parse_shard_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        study.parse_shard(text)
+
+
+def test_merge_outputs_orders_rows(tmp_path):
+    first = tmp_path / 'shard0.csv'
+    first.write_text('template,index,mass\nb.FCStd,10,1\na.FCStd,2,2\n')
+    second = tmp_path / 'shard1.csv'
+    second.write_text('template,index,mass,error\na.FCStd,9,,failed\nb.FCStd,1,4,\n')
+    output = tmp_path / 'merged.csv'
+    assert study.merge_outputs([str(first), str(second)], str(output)) == 4
+    lines = output.read_text().splitlines()
+    assert lines == [
+        'template,index,mass,error',
+        'a.FCStd,2,2,',
+        'a.FCStd,9,,failed',
+        'b.FCStd,1,4,',
+        'b.FCStd,10,1,',
+    ]